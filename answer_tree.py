@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 答案树：把题目的answers编译成前缀树，每个节点的子节点是下一步的全部正解
+# 做题时只需要记住当前节点，下一步是否正确、还有哪些正解、是否走完一个正解，都是O(1)
+# 同一棵树也用于绘制提示和导出SGF的变化图
+
+# ty：1正解,2变化,3失败,4淘汰；st：1待审,2审核完成
+BEST = 'best' # 审核完成的正解
+GOOD = 'good' # 没审核完成的正解
+
+def select_answers(answers):
+    # 有审核完成的正解时只用它们，否则用没审核完成的正解，返回 (tier, answers)
+    best = [ans for ans in answers if ans.get('ty') == 1 and ans.get('st') == 2]
+    if best:
+        return BEST, best
+    good = [ans for ans in answers if ans.get('ty') == 1 and ans.get('st') == 1]
+    if good:
+        return GOOD, good
+    return None, []
+
+class AnswerNode:
+    __slots__ = ('children', 'complete')
+
+    def __init__(self):
+        self.children = {} # sgf坐标 -> AnswerNode
+        self.complete = False # 有一个正解在这里走完
+
+class AnswerTree:
+    def __init__(self, answers=()):
+        self.root = AnswerNode()
+        self.count = 0
+        self.tier = None
+        self.answers = [] # from_answers选中的答案文档
+        for moves in answers:
+            self.add(moves)
+
+    @classmethod
+    def from_answers(cls, answers):
+        tier, selected = select_answers(answers)
+        tree = cls(ans['p'] for ans in selected)
+        tree.tier = tier
+        tree.answers = selected
+        return tree
+
+    def add(self, moves):
+        node = self.root
+        for coord in moves:
+            node = node.children.setdefault(coord, AnswerNode())
+        node.complete = True
+        self.count += 1
+
+    def find(self, moves):
+        # 沿着moves走到的节点，不是任何正解的前缀时返回None
+        node = self.root
+        for coord in moves:
+            node = node.children.get(coord)
+            if node is None:
+                return None
+        return node
+
+    def first_moves(self):
+        return set(self.root.children)
+
+    def to_sgf(self, first_color='B'):
+        # 全部正解的SGF变化图，相同的前几步只出现一次，如 (;B[aa](;W[bb];B[cc])(;W[cc]))
+        sgf = self.node_to_sgf(self.root, first_color)
+        if sgf and not sgf.startswith('('):
+            sgf = f'({sgf})'
+        return sgf
+
+    def node_to_sgf(self, node, color):
+        next_color = 'W' if color == 'B' else 'B'
+        branches = [f';{color}[{coord}]' + self.node_to_sgf(child, next_color)
+                    for coord, child in node.children.items()]
+        if len(branches) == 1:
+            return branches[0]
+        return ''.join(f'({branch})' for branch in branches)
+
+def test():
+    answers = [
+        {'ty': 1, 'st': 2, 'p': ['aa', 'bb', 'cc']},
+        {'ty': 1, 'st': 2, 'p': ['aa', 'cc']},
+        {'ty': 1, 'st': 1, 'p': ['dd']},
+        {'ty': 3, 'st': 2, 'p': ['ee']},
+    ]
+    tree = AnswerTree.from_answers(answers)
+    print(tree.tier, tree.count, tree.first_moves())
+    node = tree.find(['aa'])
+    print(set(node.children), node.complete, tree.find(['aa', 'cc']).complete, tree.find(['bb']))
+    print(tree.to_sgf())
+
+if __name__ == "__main__":
+    test()
@@ -13,7 +13,10 @@ from board import GoProblem, GoBoard
 from game import GoGame
 from tkinter import messagebox, ttk
 import json
+import queue
 from matchq import transformations, apply_transformation, parse_prepos
+from shape_index import ShapeIndex, IncrementalSearch, MongoShapeSearch, ProblemCache
+from search_worker import SearchWorker
 
 #主应用类（App） ：
 #负责初始化Tkinter主窗口，管理主要的GUI组件和事件循环。
@@ -75,6 +78,16 @@ class GoApp:
         
         # 搜索功能：动态匹配到的Top题目
         self.matching_problems = []
+        # 搜索功能：q_search的内存索引，第一次打开搜索窗口时读入；use_shape_index=False时直接查询数据库
+        self.use_shape_index = True
+        self.shape_search = None
+        self.problem_cache = ProblemCache(self.db['q'])
+        # 搜索在后台线程中进行，结果放入队列，由主循环定时取出显示
+        self.search_results = queue.Queue()
+        self.search_worker = SearchWorker(self.run_search, self.search_results.put)
+        self.display_generation = 0 # 缩略图分批绘制，有新结果时停止绘制旧结果
+        self.search_window = None
+        self.root.after(50, self.poll_search_results)
 
     def show_message_on_board(self, message):
         # 创建上方横幅的矩形，高度为棋盘的1/4
@@ -197,6 +210,9 @@ class GoApp:
             self.update_problem_info()
 
     def on_search_click(self):
+        # 后台读入索引，打开窗口不用等待
+        self.search_worker.submit(None)
+
         # 创建一个新的顶级窗口:搜索输入
         self.search_window = tk.Toplevel(self.root)
         self.search_window.title("搜索题目")
@@ -371,65 +387,65 @@ class GoApp:
         return configurations
 
     def update_matching_count(self):
-        collection = self.db['q_search']
-        col_q = self.db['q']
-
+        # 在主线程中读取搜索棋盘，在后台线程中搜索
         configurations = self.calc_search_board_min_pp_list()
         if not configurations:
             return 
+        self.search_worker.submit(configurations)
+
+    def load_shape_search(self):
+        if self.shape_search is None:
+            if self.use_shape_index:
+                self.shape_search = IncrementalSearch(ShapeIndex.load_or_build(self.db['q_search']))
+            else:
+                self.shape_search = MongoShapeSearch(self.db['q_search'])
+        return self.shape_search
 
-        #匹配数量
+    def run_search(self, configurations):
+        # 在后台线程中执行，不能操作Tk控件
+        shape_search = self.load_shape_search()
+        if configurations is None:
+            return None
+
+        #匹配数量：16个$all查询，相同min_pp只算一次；按照 min_pp 字符串长度排序，最短的在前, 保留前30个匹配结果
         start_time = time.time()
-        # 构建 $or 查询条件
-        or_clauses = []
-        for stones_list in configurations:
-            clause = {'min_pp_list': {'$all': stones_list}}
-            or_clauses.append(clause)
-        query = {'$or': or_clauses}
-
-        # 执行查询，获取匹配的文档, 按照 min_pp 字符串长度排序，最短的在前, 保留前30个匹配结果
-        cursor = collection.find(query)
-
-        # 存储已匹配的 min_pp，避免重复
-        matched_min_pp = set()
-        matching_docs = []
-
-        for doc in cursor:
-            min_pp = doc.get('min_pp')
-            if min_pp not in matched_min_pp:
-                matched_min_pp.add(min_pp)
-                matching_docs.append(doc)
-
-        # Update the label
-        total_matches = len(matching_docs)
-        message = f"当前匹配的棋形数：{total_matches}"
-        self.match_count_label.config(text=message)
-
-        matching_docs.sort(key=lambda doc: len(doc.get('min_pp', '')))
-        top_matches = matching_docs[:30]
+        total_matches, top_matches = shape_search.search(configurations, 30)
         end_time = time.time()
         print(f'$all {end_time-start_time:>5.2f}s {total_matches:>6}', end=' ')
 
         # 匹配Top
         start_time = time.time()
-        # 存储匹配题目的详细信息，供显示使用
-        self.matching_problems = []
-        for doc in top_matches:
-            problem = col_q.find_one({'status':2, 'min_pp': doc.get('min_pp')})
-            if problem:
-                self.matching_problems.append(problem)
+        # 匹配题目的详细信息，供显示使用
+        matching_problems = self.problem_cache.fetch(top_matches)
         end_time = time.time()
-        print(f'$match {end_time-start_time:>5.2f}s {len(self.matching_problems):>6}')
+        print(f'$match {end_time-start_time:>5.2f}s {len(matching_problems):>6}')
 
         # 匹配到的数量小于3个，打印min_pp
-        if len(self.matching_problems)>0 and len(self.matching_problems)<=3:
-            for p in self.matching_problems:
+        if len(matching_problems)>0 and len(matching_problems)<=3:
+            for p in matching_problems:
                 print(p.get('publicid'), p.get('min_pp'))
 
-        # Update the matching problems display
-        self.update_matching_display()
+        return total_matches, matching_problems
+
+    def poll_search_results(self):
+        # 只显示最新的结果
+        result = None
+        while not self.search_results.empty():
+            result = self.search_results.get_nowait()
+        if result is not None and self.search_window is not None and self.search_window.winfo_exists():
+            total_matches, self.matching_problems = result
+
+            # Update the label
+            message = f"当前匹配的棋形数：{total_matches}"
+            self.match_count_label.config(text=message)
+
+            # Update the matching problems display
+            self.update_matching_display()
+        self.root.after(50, self.poll_search_results)
 
     def on_search_board_cancel(self):
+        self.search_worker.cancel()
+        self.display_generation += 1
         self.search_window.destroy()
 
     def update_matching_display(self):
@@ -437,49 +453,62 @@ class GoApp:
         for widget in self.scrollable_frame.winfo_children():
             widget.destroy()
 
-        canvas_size = int(self.search_board.canvas_size / 2)  # 图形尺寸为搜索棋盘的一半
+        # 每次绘制一行缩略图，其余的交给主循环稍后绘制，绘制期间仍可在搜索棋盘上落子
+        self.display_generation += 1
+        self.draw_matching_problems(self.display_generation, self.matching_problems, 0)
 
-        for index, problem in enumerate(self.matching_problems):
-            row = index // self.search_result_columns
-            col = index % self.search_result_columns
-
-            # 创建一个容器 Frame，包含棋盘和信息
-            problem_frame = tk.Frame(self.scrollable_frame, bg='white')
-            problem_frame.grid(row=row, column=col, padx=5, pady=5)
-
-            # 创建棋盘画布
-            problem_canvas = tk.Canvas(problem_frame, width=canvas_size, height=canvas_size, bg='white')
-            problem_canvas.pack()
-
-            # 创建小尺寸的 GoBoard 和 GoGame 实例
-            mini_board = GoBoard(problem_canvas, size=problem.get('size', 19), canvas_size=canvas_size, margin=15)
-            mini_game = GoGame(mini_board)
-
-            # 加载题目到棋盘中
-            mini_game.current_problem = GoProblem(problem)
-            mini_game.reset_game()
-            mini_game.current_color = 'black' if mini_game.current_problem.blackfirst else 'white'
-
-            # 调整棋盘尺寸，显示局部棋盘
-            if mini_game.current_problem.size == full_board_size:
-                min_row, max_row, min_col, max_col = mini_game.current_problem.get_board_extent()
-                view_distance = 2
-                min_row = max(0, min_row - view_distance)
-                min_col = max(0, min_col - view_distance)
-                max_row = min(mini_board.size - 1, max_row + view_distance)
-                max_col = min(mini_board.size - 1, max_col + view_distance)
-                mini_board.draw_board(min_row=min_row, max_row=max_row, min_col=min_col, max_col=max_col)
-            else:
-                mini_board.draw_board()
-
-            # 摆放棋子
-            mini_board.place_preset_stones(mini_game.current_problem.prepos)
+    def draw_matching_problems(self, generation, problems, start):
+        if generation != self.display_generation or not self.search_window.winfo_exists():
+            return
+        end = min(start + self.search_result_columns, len(problems))
+        for index in range(start, end):
+            self.draw_matching_problem(index, problems[index])
+        if end < len(problems):
+            self.root.after(1, self.draw_matching_problems, generation, problems, end)
 
-            # 显示题目信息
-            self.display_problem_info(mini_game, problem_frame)
+    def draw_matching_problem(self, index, problem):
+        canvas_size = int(self.search_board.canvas_size / 2)  # 图形尺寸为搜索棋盘的一半
 
-            # 绑定点击事件，点击后在主棋盘中加载该题目
-            problem_canvas.bind("<Button-1>", lambda e, idx=index: self.load_problem_from_match(idx))
+        row = index // self.search_result_columns
+        col = index % self.search_result_columns
+
+        # 创建一个容器 Frame，包含棋盘和信息
+        problem_frame = tk.Frame(self.scrollable_frame, bg='white')
+        problem_frame.grid(row=row, column=col, padx=5, pady=5)
+
+        # 创建棋盘画布
+        problem_canvas = tk.Canvas(problem_frame, width=canvas_size, height=canvas_size, bg='white')
+        problem_canvas.pack()
+
+        # 创建小尺寸的 GoBoard 和 GoGame 实例
+        mini_board = GoBoard(problem_canvas, size=problem.get('size', 19), canvas_size=canvas_size, margin=15)
+        mini_game = GoGame(mini_board)
+
+        # 加载题目到棋盘中
+        mini_game.current_problem = GoProblem(problem)
+        mini_game.reset_game()
+        mini_game.current_color = 'black' if mini_game.current_problem.blackfirst else 'white'
+
+        # 调整棋盘尺寸，显示局部棋盘
+        if mini_game.current_problem.size == full_board_size:
+            min_row, max_row, min_col, max_col = mini_game.current_problem.get_board_extent()
+            view_distance = 2
+            min_row = max(0, min_row - view_distance)
+            min_col = max(0, min_col - view_distance)
+            max_row = min(mini_board.size - 1, max_row + view_distance)
+            max_col = min(mini_board.size - 1, max_col + view_distance)
+            mini_board.draw_board(min_row=min_row, max_row=max_row, min_col=min_col, max_col=max_col)
+        else:
+            mini_board.draw_board()
+
+        # 摆放棋子
+        mini_board.place_preset_stones(mini_game.current_problem.prepos)
+
+        # 显示题目信息
+        self.display_problem_info(mini_game, problem_frame)
+
+        # 绑定点击事件，点击后在主棋盘中加载该题目
+        problem_canvas.bind("<Button-1>", lambda e, idx=index: self.load_problem_from_match(idx))
 
     def display_problem_info(self, mini_problem, problem_frame):
         status_dict = { 0: "审核", 1: "取消", 2: "入库" }
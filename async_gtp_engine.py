@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# asyncio版本的GTP引擎类：不需要每个管道一个读线程，一个事件循环可以同时驱动多个引擎和数据库读写
+# 用法:
+#   engine = await AsyncGTPEngine(command).start()
+#   move = await engine.command("genmove B")
+#   async with aclosing(engine.analyze('b', 100)) as infos:
+#       async for moves in infos: ...
+
+import asyncio
+import time
+from contextlib import aclosing
+
+from kata_analyze import parse_analyze_line
+from timing import timings
+
+class AsyncGTPEngine:
+    def __init__(self, command, cwd=None):
+        self.command_line = command
+        self.cwd = cwd
+        self.process = None
+        self.stderr_task = None
+        self.stderr_lines = []
+        self.ready = asyncio.Event()
+        self.lock = asyncio.Lock() # 同一个引擎上的命令依次执行
+        self.broken = False # 超时后回复读了一半，后面的回复会错位，引擎不能再用
+
+    async def start(self, timeout=120):
+        self.engine_start_time = time.time()
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command_line,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self.cwd
+        )
+        self.stderr_task = asyncio.create_task(self.read_stderr())
+        await self.wait_for_ready(timeout)
+        return self
+
+    async def read_stderr(self):
+        while True:
+            line = await self.process.stderr.readline()
+            if not line:
+                break
+            line = line.decode()
+            if "GTP ready" in line:
+                self.ready.set()
+            self.stderr_lines.append(line)
+
+    async def wait_for_ready(self, timeout=120):
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("GTP Engine did not become ready in time")
+        duration = time.time() - self.engine_start_time
+        timings.add('engine_startup', duration)
+        print(f'GTP ready cost {duration:>5.2f}s')
+
+    async def read_line(self):
+        line = await self.process.stdout.readline()
+        if not line:
+            raise EOFError("GTP Engine exited")
+        return line.decode()
+
+    async def write(self, text):
+        self.process.stdin.write(text.encode())
+        await self.process.stdin.drain()
+
+    async def read_response(self, resp_num=1):
+        # 和GTPEngine.send_command相同的格式：去掉'='或'?'，读到resp_num个空行为止
+        response = ''
+        resp_count = 0
+        while True:
+            line = await self.read_line()
+            if line.startswith('=') or line.startswith('?'):
+                response += line[1:].rstrip('\n')
+                while True:
+                    next_line = await self.read_line()
+                    if next_line == '\n':
+                        resp_count += 1
+                        if resp_count == resp_num:
+                            break
+                    response += '\n' + next_line.rstrip('\n')
+                break
+            else:
+                print('line', line)
+        return response
+
+    def check_broken(self):
+        if self.broken:
+            raise EOFError("GTP Engine stopped after response timeout")
+
+    def mark_broken(self):
+        # 超时时stdout中还有没读完的回复，停止引擎，之后的命令都抛出EOFError
+        self.broken = True
+        if self.process.returncode is None:
+            try:
+                self.process.terminate()
+            except ProcessLookupError:
+                pass
+
+    async def command(self, command, resp_num=1, timeout=None):
+        async with self.lock:
+            self.check_broken()
+            await self.write(command + '\n')
+            try:
+                return await asyncio.wait_for(self.read_response(resp_num), timeout)
+            except asyncio.TimeoutError:
+                self.mark_broken()
+                raise TimeoutError("GTP Engine response timeout")
+
+    async def analyze(self, color='b', interval=100, budget=None):
+        # kata-analyze的异步迭代器，每个info行返回一次候选手列表，和GTPEngine.analyze相同
+        # 提前退出时请用aclosing包裹，保证发送停止命令并读完剩余输出
+        async with self.lock:
+            self.check_broken()
+            await self.write(f'kata-analyze {color} {interval}\n')
+            while True:
+                line = await self.read_line()
+                if line.startswith('='):
+                    break
+                if line.startswith('?'):
+                    await self.read_line() # 错误回复后的空行
+                    raise RuntimeError(f"kata-analyze failed: {line[1:].strip()}")
+                print('line', line)
+
+            if budget is not None:
+                budget.start()
+            finished = False
+            try:
+                while True:
+                    line = await self.read_line()
+                    if line == '\n':
+                        finished = True # 引擎自己结束了分析
+                        return
+                    moves = parse_analyze_line(line)
+                    if not moves:
+                        continue
+                    yield moves
+                    if budget is not None and budget.done(moves):
+                        return
+            finally:
+                if not finished and self.process.returncode is None:
+                    # 任意输入都会停止分析，读到空行结束
+                    await self.write('\n')
+                    while await self.read_line() != '\n':
+                        pass
+
+    async def close(self):
+        if self.process.returncode is None:
+            try:
+                self.process.terminate()
+            except ProcessLookupError:
+                pass
+            await self.process.wait()
+        if self.stderr_task:
+            await self.stderr_task
+
+async def genmove_on(engine, color):
+    await engine.command('boardsize 19\nclear_board\nkomi 7.5', 3)
+    return await engine.command(f'genmove {color}')
+
+async def test_async():
+    from bench_gtp import fake_engine_command
+    # 同一个事件循环驱动多个引擎
+    engines = await asyncio.gather(*[AsyncGTPEngine(fake_engine_command('-latency', '0.2')).start() for i in range(4)])
+
+    start_time = time.time()
+    moves = await asyncio.gather(*[genmove_on(engine, 'B') for engine in engines])
+    duration = time.time() - start_time
+    print(moves, f'{duration:>5.2f}s')
+
+    async with aclosing(engines[0].analyze('b', 100)) as infos:
+        async for moves in infos:
+            print(moves[0])
+            break
+
+    await asyncio.gather(*[engine.close() for engine in engines])
+
+def test():
+    asyncio.run(test_async())
+
+if __name__ == "__main__":
+    test()
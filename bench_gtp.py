@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# GTPEngine读写延迟测试，使用fake_gtp_engine.py，不需要KataGo
+
+import os
+import sys
+import time
+
+from gtp_engine import GTPEngine
+
+def fake_engine_command(*args):
+    fake = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_gtp_engine.py')
+    return [sys.executable, fake, *args]
+
+def bench_single(gtp_engine, rounds=200):
+    # 一问一答，测量每条命令的往返延迟
+    start_time = time.time()
+    for i in range(rounds):
+        gtp_engine.send_command('play B Q16')
+    duration = time.time() - start_time
+    print(f'single {rounds:>5} cmds {duration:>6.3f}s {1000*duration/rounds:>7.3f}ms/cmd')
+
+def setup_commands(stones=150):
+    # 和solve_problem一样，boardsize/clear_board/komi和150个play
+    letters = 'ABCDEFGHJKLMNOPQRST'
+    cmd_list = ['boardsize 19', 'clear_board', 'komi 7.5']
+    for i in range(stones):
+        cmd_list.append(f'play B {letters[i % 19]}{i // 19 + 1}')
+    return cmd_list
+
+def bench_batch(gtp_engine, rounds=20, stones=150):
+    cmd_list = setup_commands(stones)
+    cmd_str = '\n'.join(cmd_list) + '\n'
+    resp_num = len(cmd_list)
+    start_time = time.time()
+    for i in range(rounds):
+        gtp_engine.send_command(cmd_str, resp_num)
+    duration = time.time() - start_time
+    print(f'batch  {rounds:>5} x {resp_num} cmds {duration:>6.3f}s {1000*duration/rounds:>7.3f}ms/problem')
+
+def bench_pipeline(gtp_engine, rounds=20, stones=150):
+    cmd_list = setup_commands(stones) + ['genmove b']
+    cmd_str = '\n'.join(cmd_list[:-1]) + '\n'
+
+    # 依次：摆题，等回复，genmove，等回复
+    start_time = time.time()
+    for i in range(rounds):
+        gtp_engine.send_command(cmd_str, len(cmd_list) - 1)
+        gtp_engine.send_command('genmove b')
+    duration = time.time() - start_time
+    print(f'serial   {rounds:>5} problems {duration:>6.3f}s {1000*duration/rounds:>7.3f}ms/problem')
+
+    # 流水线：genmove思考时，下一题的摆题命令已经提交
+    start_time = time.time()
+    ids = gtp_engine.submit(cmd_list)
+    for i in range(rounds):
+        next_ids = gtp_engine.submit(cmd_list) if i < rounds - 1 else []
+        results = gtp_engine.wait_results(ids)
+        failed = [r for r in results if not r['ok']]
+        if failed:
+            print('failed', failed)
+        ids = next_ids
+    duration = time.time() - start_time
+    print(f'pipeline {rounds:>5} problems {duration:>6.3f}s {1000*duration/rounds:>7.3f}ms/problem')
+
+def bench_setup(gtp_engine, rounds=20, stones=150):
+    # 每题摆题耗时：逐个play 对比 set_position
+    cmd_list = setup_commands(stones)
+    start_time = time.time()
+    for i in range(rounds):
+        gtp_engine.send_commands(cmd_list)
+    duration = time.time() - start_time
+    print(f'play         {rounds:>5} problems {duration:>6.3f}s {1000*duration/rounds:>7.3f}ms/problem')
+
+    set_position = 'set_position ' + ' '.join('B ' + c.split()[-1] for c in cmd_list[3:])
+    bulk_list = cmd_list[:1] + cmd_list[2:3] + [set_position]
+    start_time = time.time()
+    for i in range(rounds):
+        gtp_engine.send_commands(bulk_list)
+    duration = time.time() - start_time
+    print(f'set_position {rounds:>5} problems {duration:>6.3f}s {1000*duration/rounds:>7.3f}ms/problem')
+
+def test():
+    gtp_engine = GTPEngine(fake_engine_command())
+    bench_single(gtp_engine)
+    bench_batch(gtp_engine)
+    gtp_engine.close()
+
+    gtp_engine = GTPEngine(fake_engine_command('-latency', '0.01'))
+    bench_pipeline(gtp_engine)
+    bench_setup(gtp_engine)
+    gtp_engine.close()
+
+if __name__ == "__main__":
+    test()
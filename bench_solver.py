@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 做题流水线的端到端测试：fake_gtp_engine.py代替KataGo，生成的题目代替q表格，不需要Mac和KataGo
+# 输出每秒做题数，以及摆题(setup)、genmove、比对(compare)、写数据库(db)各阶段延迟的p50/p99
+# 数据库默认是内存里的MemoryCollection，test(use_mongo=True)时写入MongoDB的q_do_bench表格
+
+import io
+import random
+import time
+from contextlib import redirect_stdout
+from pymongo import MongoClient
+
+from bench_gtp import fake_engine_command
+from gtp_engine import GTPEngine
+from engine_pool import EnginePool
+from solver import GoProblemSolver
+from do_problem import do_one_problem
+from q_do_writer import QDoWriter
+from config import db_name
+
+STAGES = ['setup', 'genmove', 'compare', 'db']
+
+def sgf(x, y):
+    return chr(x + ord('a')) + chr(y + ord('a'))
+
+def make_problem(publicid, rng):
+    # 左上角的死活题：白棋一条斜线在角上，黑棋在外面一条斜线包围，正解是黑白之间的一个或几个空点
+    # fake_gtp_engine的genmove落在黑白之间，所以有的题做对，有的题做错后再黑白交换、劫财重做
+    n = rng.randint(4, 7)
+    w = [sgf(x, n - 1 - x) for x in range(n) if rng.random() < 0.9]
+    b = [sgf(x, n + 1 - x) for x in range(n + 2) if rng.random() < 0.9]
+    points = [sgf(x, n - x) for x in range(n + 1)]
+    answers = rng.sample(points, rng.randint(1, 2))
+    return {
+        'publicid': publicid,
+        'level': '8K',
+        'prepos': {'b': b, 'w': w},
+        'answers': [{'ty': 1, 'st': 2, 'p': [p]} for p in answers],
+        'blackfirst': True,
+        'size': 19,
+    }
+
+def make_problems(num, seed=0):
+    # 相同seed生成相同的题目
+    rng = random.Random(seed)
+    return [make_problem(i + 1, rng) for i in range(num)]
+
+class MemoryCollection:
+    # 只记录写入次数的q_do，测量不含数据库本身的开销
+    def __init__(self):
+        self.written = 0
+
+    def find(self, *args, **kwargs):
+        return []
+
+    def bulk_write(self, operations, ordered=True):
+        self.written += len(operations)
+
+class TimedCollection:
+    # 记录每次bulk_write的耗时
+    def __init__(self, collection):
+        self.collection = collection
+        self.latencies = []
+
+    def find(self, *args, **kwargs):
+        return self.collection.find(*args, **kwargs)
+
+    def bulk_write(self, operations, ordered=True):
+        start_time = time.perf_counter()
+        result = self.collection.bulk_write(operations, ordered=ordered)
+        self.latencies.append(time.perf_counter() - start_time)
+        return result
+
+def q_do_collection(use_mongo):
+    if use_mongo:
+        client = MongoClient()
+        return TimedCollection(client[db_name]['q_do_bench'])
+    return TimedCollection(MemoryCollection())
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+def print_latency(name, values):
+    p50 = 1000 * percentile(values, 50)
+    p99 = 1000 * percentile(values, 99)
+    print(f'{name:<10} {len(values):>6} p50 {p50:>8.3f}ms p99 {p99:>8.3f}ms')
+
+def bench_stages(gtp_engine, problems, use_mongo=False):
+    # 一个引擎依次做题，分别计时每个阶段；db是后台线程每批bulk_write的耗时
+    latencies = {stage: [] for stage in STAGES}
+    q_do_col = q_do_collection(use_mongo)
+    writer = QDoWriter(q_do_col, 'bench')
+    ok = 0
+    start_time = time.perf_counter()
+    for q in problems:
+        with redirect_stdout(io.StringIO()):
+            solver = GoProblemSolver(q, keepsize=True)
+            t0 = time.perf_counter()
+            solver.setup_board(gtp_engine)
+            t1 = time.perf_counter()
+            response = gtp_engine.send_commands([solver.genmove_command()])[-1]['payload']
+            t2 = time.perf_counter()
+            ret, ans = solver.check_move(response)
+            t3 = time.perf_counter()
+        latencies['setup'].append(t1 - t0)
+        latencies['genmove'].append(t2 - t1)
+        latencies['compare'].append(t3 - t2)
+        writer.put(q['publicid'], {'bw': 10, 'ret': ret, 'level': q['level'], 'answer': ans})
+        ok += ret
+    with redirect_stdout(io.StringIO()):
+        writer.close()
+    duration = time.perf_counter() - start_time
+    latencies['db'] = q_do_col.latencies
+
+    print(f'stages {len(problems)} problems {duration:>6.3f}s {len(problems) / duration:>8.1f} problems/s OK {ok}')
+    for stage in STAGES:
+        print_latency(stage, latencies[stage])
+    return latencies
+
+def bench_end_to_end(problems, engine_num=2, latency=0.01, use_mongo=False):
+    # do_one_problem经引擎池并行做题，和do_all_problem相同，包括黑白交换、劫财的重做
+    pool = EnginePool(fake_engine_command('-latency', str(latency)), size=engine_num)
+    q_do_col = q_do_collection(use_mongo)
+    writer = QDoWriter(q_do_col, 'bench')
+    latencies = []
+
+    def solve_one(gtp_engine, q):
+        s_time = time.perf_counter()
+        result = do_one_problem(gtp_engine, q)
+        latencies.append(time.perf_counter() - s_time)
+        return result
+
+    start_time = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        for q, (bw, ret, answer) in pool.map_unordered(solve_one, problems):
+            writer.put(q['publicid'], {'bw': bw, 'ret': ret, 'level': q['level'], 'answer': answer})
+        writer.close()
+    duration = time.perf_counter() - start_time
+    pool.close()
+
+    print(f'end-to-end {engine_num} engines latency {latency}s {len(problems)} problems '
+          f'{duration:>6.3f}s {len(problems) / duration:>8.1f} problems/s')
+    print_latency('problem', latencies)
+    print_latency('db', q_do_col.latencies)
+
+def test(num=200, use_mongo=False):
+    problems = make_problems(num)
+
+    gtp_engine = GTPEngine(fake_engine_command())
+    bench_stages(gtp_engine, problems, use_mongo)
+    gtp_engine.close()
+
+    gtp_engine = GTPEngine(fake_engine_command('-no-set-position'))
+    print('-no-set-position', end=' ')
+    bench_stages(gtp_engine, problems, use_mongo)
+    gtp_engine.close()
+
+    bench_end_to_end(problems, engine_num=1, use_mongo=use_mongo)
+    bench_end_to_end(problems, engine_num=4, use_mongo=use_mongo)
+
+if __name__ == "__main__":
+    test()
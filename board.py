@@ -4,6 +4,7 @@
 from pymongo import MongoClient
 from pprint import pprint
 from config import db_name, letter_to_num, full_board_size, num_to_letter
+from position import Position
 
 #棋盘类（GoBoard） ：
 #负责绘制棋盘，管理棋盘状态（例如，哪些位置有棋子，棋子的颜色等）。
@@ -223,6 +224,14 @@ class GoProblem:
         problems = [GoProblem(problem_data) for problem_data in problems_data]
         return problems
 
+    # 初始局面，不依赖Tk
+    def position(self):
+        return Position.from_prepos(self.prepos, self.size)
+
+    # 规范局面的64位Zobrist哈希：对称、黑白交换后相同的题目哈希相同，用于查找重复题目
+    def canonical_hash(self):
+        return self.position().canonical_hash()[0]
+
     #  calculate the board extent needed by the problem
     def get_board_extent(self):
         positions = set()
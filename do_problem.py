@@ -3,136 +3,184 @@
 
 import subprocess
 import threading
+import asyncio
+import copy
 import time
-from pymongo import MongoClient, UpdateOne
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pymongo import MongoClient
 
 from detect_surrounding import detect_one
 from read_katago_info import read_katago_config
-from get_temperature import get_temperature
-from gtp_engine import GTPEngine
+from engine_pool import EnginePool
+from engine_supervisor import ENGINE_ERRORS
+from async_gtp_engine import AsyncGTPEngine
 from solver import GoProblemSolver
+from solve_cache import SolveCache
+from progress_journal import ProgressJournal
+from q_do_writer import QDoWriter
+from thermal import ThermalThrottle
+from timing import timings, span, count
 from config import db_name
 
-def log_diff(publicid, existing_doc, new_values):
-    if existing_doc is None:
-        print(f"{publicid:>6} 新增")
-    else:
-        for field in new_values:
-            old_value = existing_doc.get(field)
-            new_value = new_values[field]
-            if old_value != new_value:
-                print(f"{publicid:>6} {field:>6} 从 {old_value} 修改为 {new_value}")
-
-def process_batch(q_do_col, publicid_list, new_values_list, katago_ver):
-    if not publicid_list:
-        return
-    # 批量获取已有的文档
-    existing_docs = q_do_col.find({'publicid': {'$in': publicid_list}})
-    existing_docs_dict = {doc['publicid']: doc for doc in existing_docs}
-
-    bulk_operations = []
-
-    # 处理批次中的每个记录
-    for idx, pid in enumerate(publicid_list):
-        new_values = new_values_list[idx]
-        new_ret = new_values.get('ret')
-        existing_doc = existing_docs_dict.get(pid)
-
-        #log_diff(pid, existing_doc, new_values)
-
-        # 准备批量更新操作
-        bulk_operations.append(
-            UpdateOne(
-                {'publicid': pid, 'ver': katago_ver},
-                {'$set': new_values},
-                upsert=True
-            )
-        )
-
-    # 执行批量更新
-    if bulk_operations:
-        q_do_col.bulk_write(bulk_operations)
-
-def already_done(q_do_col, publicid, katago_ver):
-    comment_lists = [
-        {'publicid':1895, 'comment':'更像对杀题，外面一定能活得黑子和白子'},
-        {'publicid':3416, 'comment':'9x8范围更像边上的死活，ratio 4.46, dist 4.4'},
-        {'publicid':3620, 'comment':'内部还有2x3一小块 dist 4.2'},
-        {'publicid':5073, 'comment':'被包围子有2个子穿过了空挡 ratio 4.2'},
-        {'publicid':5531, 'comment':'半个棋盘，边上的对杀'},
-        {'publicid':10902, 'comment':'角上对杀'},
-        {'publicid':43156, 'comment':'角上对杀'},
-        {'publicid':59954, 'comment':'角上死活，有3个空，被包围黑可达所有边界，白虽然ratio有3个达标[0.22, 0.09, 4.75, 0.15]，但是左右dist2个不够[11.7, 0.9, 2.0, 1.2], 原因左右方向白子一条直线的太多，而且中间有空挡'},
-
-        {'publicid':4728, 'comment':'正解是双活。死活权重，会导向开劫，而后万劫不应。普通权重也是先开劫，如果增加2块有2口外气的白盘角曲四作为劫材，komi299，可以得到正解'},
-        {'publicid':12683, 'comment':'应该是黑白正常'},
-        {'publicid':44390, 'comment':'应该是黑白正常，且对杀'},
-        {'publicid':53703, 'comment':'应该是黑白交换'},
-        {'publicid':55796, 'comment':'外面包裹的黑子太多影响了关键死活的判断，题目要求先从外面延气，然后进行对杀'},
-        {'publicid':65325, 'comment':'正解净杀，内部黑子走中间，使得黑子两边黑白都不入气，只能由黑从外部收起杀白。而死活权重，会导向开劫杀，依赖于对于任何劫材都不回应'},
-        {'publicid':74824, 'comment':'死活权重，po高于10可以做对'},
-        {'publicid':80989, 'comment':'构造黑棋盘角曲四，即b_threat，强迫黑不开劫，死活权重，可以得到正解，黑净杀白。b_threat：内部黑曲四，白包围在外，且有3口以上外气'},
-        {'publicid':84444, 'comment':'白先双活，需构造2个白盘角曲四，如果白劫活需要损失1个盘角曲四'},
-        {'publicid':143592, 'comment':'黑净杀，构造1个黑盘角曲四，如果黑劫杀需要损失1个盘角曲四,komi357'},
-        {'publicid':178295, 'comment':'同4728'},
-        {'publicid':233194, 'comment':'死活权重，对称，50po；普通权重，正常，50po'},
-        {'publicid':242451, 'comment':'黑先，增加黑有损失的劫材（白的劫材），迫使黑不导向劫'},
-        {'publicid':391513, 'comment':'死活权重，高po可以做对'},
-        {'publicid':1, 'comment':''},
-
-    ]
-    comment_set = set()
-    for i in comment_lists:
-        comment_set.add(i.get('publicid'))
-
-    # 跳过记录的题目
-    if publicid in comment_set:
-        return True
-
-    # 跳过已经做过的题目，ver格式 b28-p10, 死活权重28b，10 playouts
-    existing = q_do_col.find_one({'publicid':publicid, 'ver':katago_ver})
-    #existing = False # 解除注释，重做全部题目
-    if existing:
-        #return True # 只要做过就不再做
-        if existing.get('ret'):
-            #print('已做  ')
-            return True
-        if existing.get('comment'):
-            #print('已备注')
-            return True
-    return False
-
-def print_bw_info(bw):
+# 跳过的题目及原因
+SKIP_COMMENTS = [
+    {'publicid':1895, 'comment':'更像对杀题，外面一定能活得黑子和白子'},
+    {'publicid':3416, 'comment':'9x8范围更像边上的死活，ratio 4.46, dist 4.4'},
+    {'publicid':3620, 'comment':'内部还有2x3一小块 dist 4.2'},
+    {'publicid':5073, 'comment':'被包围子有2个子穿过了空挡 ratio 4.2'},
+    {'publicid':5531, 'comment':'半个棋盘，边上的对杀'},
+    {'publicid':10902, 'comment':'角上对杀'},
+    {'publicid':43156, 'comment':'角上对杀'},
+    {'publicid':59954, 'comment':'角上死活，有3个空，被包围黑可达所有边界，白虽然ratio有3个达标[0.22, 0.09, 4.75, 0.15]，但是左右dist2个不够[11.7, 0.9, 2.0, 1.2], 原因左右方向白子一条直线的太多，而且中间有空挡'},
+
+    {'publicid':4728, 'comment':'正解是双活。死活权重，会导向开劫，而后万劫不应。普通权重也是先开劫，如果增加2块有2口外气的白盘角曲四作为劫材，komi299，可以得到正解'},
+    {'publicid':12683, 'comment':'应该是黑白正常'},
+    {'publicid':44390, 'comment':'应该是黑白正常，且对杀'},
+    {'publicid':53703, 'comment':'应该是黑白交换'},
+    {'publicid':55796, 'comment':'外面包裹的黑子太多影响了关键死活的判断，题目要求先从外面延气，然后进行对杀'},
+    {'publicid':65325, 'comment':'正解净杀，内部黑子走中间，使得黑子两边黑白都不入气，只能由黑从外部收起杀白。而死活权重，会导向开劫杀，依赖于对于任何劫材都不回应'},
+    {'publicid':74824, 'comment':'死活权重，po高于10可以做对'},
+    {'publicid':80989, 'comment':'构造黑棋盘角曲四，即b_threat，强迫黑不开劫，死活权重，可以得到正解，黑净杀白。b_threat：内部黑曲四，白包围在外，且有3口以上外气'},
+    {'publicid':84444, 'comment':'白先双活，需构造2个白盘角曲四，如果白劫活需要损失1个盘角曲四'},
+    {'publicid':143592, 'comment':'黑净杀，构造1个黑盘角曲四，如果黑劫杀需要损失1个盘角曲四,komi357'},
+    {'publicid':178295, 'comment':'同4728'},
+    {'publicid':233194, 'comment':'死活权重，对称，50po；普通权重，正常，50po'},
+    {'publicid':242451, 'comment':'黑先，增加黑有损失的劫材（白的劫材），迫使黑不导向劫'},
+    {'publicid':391513, 'comment':'死活权重，高po可以做对'},
+    {'publicid':1, 'comment':''},
+
+]
+SKIP_PUBLICIDS = {i.get('publicid') for i in SKIP_COMMENTS}
+
+def load_done_set(q_do_col, katago_ver):
+    # 一次查询读入已做对或已备注的publicid，ver格式 b28-p10, 死活权重28b，10 playouts
+    done = q_do_col.find(
+        {'ver': katago_ver, '$or': [{'ret': True}, {'comment': {'$nin': [None, '']}}]},
+        {'_id': 0, 'publicid': 1}
+    )
+    done_set = {doc['publicid'] for doc in done}
+    print(f'已做 {len(done_set)} 跳过 {len(SKIP_PUBLICIDS)}')
+    return done_set | SKIP_PUBLICIDS
+
+def already_done(done_set, publicid):
+    # done_set由load_done_set得到，包含跳过的题目
+    #return False # 解除注释，重做全部题目
+    return publicid in done_set
+
+# 题目范围
+PROBLEM_CRITERIA = {'status': 2, 'qtype':'死活题', 'level':'8K+', 'size':19}
+#PROBLEM_CRITERIA = {'publicid': {'$in':[3707]}}
+
+# 做题需要的字段
+PROBLEM_PROJECTION = {'_id': 0, 'publicid': 1, 'level': 1, 'prepos': 1, 'answers': 1, 'blackfirst': 1, 'size': 1}
+
+def iter_problems(q_col, done_set, criteria=PROBLEM_CRITERIA, batch_size=100):
+    # 流式读取题目，已做的在查询中排除，内存不随题目总数增长
+    # 按publicid分页，每页一次查询、立即读完，不保持服务器端游标：
+    # 一页题目要做很久，游标空闲超过10分钟会被服务器回收，再读时CursorNotFound
+    conditions = [criteria]
+    if done_set:
+        conditions.append({'publicid': {'$nin': list(done_set)}})
+    last_publicid = None
+    while True:
+        query = conditions if last_publicid is None else conditions + [{'publicid': {'$gt': last_publicid}}]
+        query = {'$and': query} if len(query) > 1 else dict(criteria)
+        docs = list(q_col.find(query, PROBLEM_PROJECTION).sort('publicid', 1).limit(batch_size))
+        if not docs:
+            return
+        last_publicid = docs[-1].get('publicid')
+        for doc in docs:
+            q = {
+                'publicid': doc.get('publicid'), 
+                'level': doc.get('level'), 
+                'prepos':doc.get('prepos'), 
+                'answers':doc.get('answers'), 
+                'blackfirst':doc.get('blackfirst'),
+                'size':doc.get('size'),
+            }
+            if already_done(done_set, q.get('publicid')):
+                continue
+            yield q
+        if len(docs) < batch_size:
+            return
+
+def bw_info(bw):
     match bw:
         case 10:
-            print("黑白正常", end=' ')
+            return "黑白正常"
         case 11:
-            print("黑白劫财", end=' ')
+            return "黑白劫财"
         case 20:
-            print("黑白交换", end=' ')
+            return "黑白交换"
         case 21:
-            print("交换劫财", end=' ')
+            return "交换劫财"
         case _:
-            print("未知值")
+            return "未知值"
+
+def print_log(log, parts):
+    # log为None时直接打印一行，否则放入log，由调用方和做题结果一起打印
+    if log is None:
+        print(' '.join(parts))
+    else:
+        log.extend(parts)
 
 def attempt_do_one_problem(gtp_engine, solver, bw):
-    print_bw_info(bw)
+    solver.log.append(bw_info(bw))
     ret, ans = solver.solve_problem(gtp_engine)
     if not ret:
         bw += 1
-        print_bw_info(bw)
+        solver.log.append(bw_info(bw))
         solver.symmetry_fill_black_in_empty_board()
         ret, ans = solver.solve_problem(gtp_engine)
     return ret, ans
 
-def do_one_problem(gtp_engine, q, sleep_ratio):
-    b_surrounding = detect_one(q)
+async def attempt_do_one_problem_async(engine, solver, bw):
+    solver.log.append(bw_info(bw))
+    ret, ans = await solver.solve_problem_async(engine)
+    if not ret:
+        bw += 1
+        solver.log.append(bw_info(bw))
+        solver.symmetry_fill_black_in_empty_board()
+        ret, ans = await solver.solve_problem_async(engine)
+    return ret, ans
+
+async def do_one_problem_async(engine, q, log=None):
+    # 和do_one_problem相同，engine是AsyncGTPEngine
+    with span('detect_one'):
+        b_surrounding = detect_one(q)
+
+    ret = False
+    ans = ''
+    solver = GoProblemSolver(q, keepsize=True)
+    if b_surrounding == 1: #黑包围白
+        bw = 10
+        ret, ans = await attempt_do_one_problem_async(engine, solver, bw)
+    elif b_surrounding == 2:
+        solver.swap_black_white()
+        bw = 20
+        ret, ans = await attempt_do_one_problem_async(engine, solver, bw)
+    else:
+        bw = 10
+        ret, ans = await attempt_do_one_problem_async(engine, solver, bw)
+        if not ret:
+            solver.swap_black_white()
+            bw = 20
+            ret, ans = await attempt_do_one_problem_async(engine, solver, bw)
+    print_log(log, solver.log)
+    return bw, ret, ans
+
+def do_one_problem(gtp_engine, q, throttle=None, early_stop=None, cache=None, log=None):
+    # log: 做题过程的输出放入这个list，见print_log
+    with span('detect_one'):
+        b_surrounding = detect_one(q)
     start_time = time.time()
 
     ret = False
     answer = ''
     bw = 3
     solver = GoProblemSolver(q, keepsize=True)
+    solver.early_stop = early_stop
+    solver.cache = cache
     if b_surrounding == 1: #黑包围白
         bw = 10
         ret, ans = attempt_do_one_problem(gtp_engine, solver, bw)
@@ -151,36 +199,147 @@ def do_one_problem(gtp_engine, q, sleep_ratio):
 
     end_time = time.time()
     duration = end_time-start_time
-    print(f'{duration:>5.2f}s')
-    time.sleep(sleep_ratio * duration)
+    timings.add('problem', duration, publicid=q.get('publicid'), bw=bw, ret=ret)
+    solver.log.append(f'{duration:>5.2f}s')
+    print_log(log, solver.log)
+    if throttle is not None:
+        # 按温度休息，休息期间引擎不做题
+        throttle.pace(duration)
 
     return bw, ret, ans
 
-def do_all_problem():
-    # Start GTP engine
-    # 普通权重
-    katago_cfg_filename = '/Users/zliu/go/katago/gtp_normal_v500.cfg'
-    weight_name = 'n28'
-    katago_po = read_katago_config(katago_cfg_filename).get('maxPlayouts')
-    katago_ver = weight_name + '-p' + katago_po
-    engine_command = [
-        "/Users/zliu/go/katago/katago-metal-1move", "gtp", 
-        "-config", katago_cfg_filename,
-        "-model", "/Users/zliu/go/katago/b28.bin.gz",
-    ]
-    gtp_engine1 = GTPEngine(engine_command)
+def make_variant(q, swap=False, symmetry=False):
+    # 每个变体用独立的题目副本，swap_black_white会修改prepos
+    solver = GoProblemSolver(copy.deepcopy(q), keepsize=True)
+    if swap:
+        solver.swap_black_white()
+    if symmetry:
+        solver.symmetry_fill_black_in_empty_board()
+    return solver
+
+def build_variants(q, b_surrounding):
+    # 和do_one_problem相同的尝试范围，一次构造好全部变体：[(bw, solver)]
+    variants = []
+    if b_surrounding != 2: # 黑包围白，或者不确定
+        variants.append((10, make_variant(q)))
+        variants.append((11, make_variant(q, symmetry=True)))
+    if b_surrounding != 1: # 白包围黑，或者不确定
+        variants.append((20, make_variant(q, swap=True)))
+        variants.append((21, make_variant(q, swap=True, symmetry=True)))
+    return variants
+
+def solve_variant(gtp_engine, solver, cancel):
+    if cancel.is_set():
+        return False, {'cancelled': True}
+    return solver.solve_problem(gtp_engine)
+
+def do_one_problem_race(pool, q, early_stop=None, cache=None, throttle=None, log=None):
+    # 全部变体同时提交到引擎池，第一个做对的返回，其余取消
+    # 还没开始的直接取消；流式分析(early_stop)中的在下一行info时停止；genmove只能等它做完后归还引擎
+    start_time = time.time()
+    with span('detect_one'):
+        b_surrounding = detect_one(q)
+
+    with span('variants'):
+        variants = build_variants(q, b_surrounding)
+    cancel = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=len(variants))
+    futures = {}
+    solvers = dict(variants)
+    for bw, solver in variants:
+        solver.early_stop = early_stop
+        solver.cancel = cancel
+        solver.cache = cache
+        futures[executor.submit(pool.run, solve_variant, solver, cancel)] = bw
+
+    results = {}
+    errors = []
+    parts = []
+    win = None
+    for future in as_completed(futures):
+        bw = futures[future]
+        try:
+            results[bw] = future.result()
+        except Exception as e:
+            # 和map_unordered(skip_errors=True)相同，出错的变体打印后算作做错
+            kind = 'engine error' if isinstance(e, ENGINE_ERRORS) else 'error'
+            parts.append(f'{bw_info(bw)} {kind} {e!r}')
+            errors.append(e)
+            continue
+        parts.append(bw_info(bw))
+        parts.extend(solvers[bw].log)
+        if results[bw][0]:
+            win = bw
+            break
+    cancel.set()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    end_time = time.time()
+    duration = end_time-start_time
+    parts.append(f'{duration:>5.2f}s')
+    print_log(log, parts)
+    if throttle is not None:
+        throttle.pace(duration)
+
+    if not results:
+        # 全部变体出错，和非race模式一样跳过这道题
+        raise errors[-1]
+    if win is None:
+        # 全部做错，和do_one_problem相同，返回最后尝试的黑白方向
+        win = variants[-1][0]
+    ret, ans = results.get(win, (False, ''))
+    # bw和do_one_problem相同，只记录黑白方向10/20，劫财变体11/21记为10/20
+    bw = win - win % 10
+    timings.add('problem', duration, publicid=q.get('publicid'), bw=bw, ret=ret)
+    return bw, ret, ans
+
+def race_problems(pool, todo_list, early_stop=None, cache=None, throttle=None):
+    # race模式逐题做，出错的题目打印后跳过，和map_unordered(skip_errors=True)相同
+    for q in todo_list:
+        log = []
+        try:
+            bw, ret, ans = do_one_problem_race(pool, q, early_stop, cache, throttle, log)
+        except Exception as e:
+            kind = 'engine error' if isinstance(e, ENGINE_ERRORS) else 'error'
+            print(f"skip {q.get('publicid')} {kind} {e!r}")
+            count('task_failed')
+            continue
+        yield q, (bw, ret, ans, ' '.join(log))
+
+# 引擎设置：权重名 -> (katago配置, 模型)，普通权重和死活权重
+ENGINE_SETUPS = {
+    'n28': ('/Users/zliu/go/katago/gtp_normal_v500.cfg', '/Users/zliu/go/katago/b28.bin.gz'),
+    'b18': ('/Users/zliu/go/katago/gtp_killall_do_problem.cfg', '/Users/zliu/go/katago/lifego_b18.bin.gz'),
+}
 
-    # 死活权重
-    katago_cfg_filename = '/Users/zliu/go/katago/gtp_killall_do_problem.cfg'
-    weight_name = 'b18'
+def katago_engine_setup(weight_name):
+    # 返回 katago_ver 和引擎启动命令，ver格式 b28-p10, 死活权重28b，10 playouts
+    katago_cfg_filename, model_filename = ENGINE_SETUPS[weight_name]
     katago_po = read_katago_config(katago_cfg_filename).get('maxPlayouts')
     katago_ver = weight_name + '-p' + katago_po
     engine_command = [
         "/Users/zliu/go/katago/katago-metal-1move", "gtp", 
         "-config", katago_cfg_filename,
-        "-model", "/Users/zliu/go/katago/lifego_" + weight_name + ".bin.gz",
+        "-model", model_filename,
     ]
-    gtp_engine = GTPEngine(engine_command)
+    return katago_ver, engine_command
+
+def do_all_problem(weight_name='b18', engine_num=2, early_stop=None, race=False, use_cache=True,
+                   target_temp=60, timing_file=None, command_timeout=600, standby=True, batch_size=100):
+    # Start GTP engines，同一个权重启动engine_num个引擎并行做题
+    # early_stop: 如 {} 或 {'max_visits': 500}，用kata-analyze流式分析提前判定，参数见solver.EARLY_STOP
+    # race: 每道题的全部变体同时在引擎池里做，第一个做对即返回；题目之间依次进行
+    # use_cache: 相同局面（对称、黑白交换）的genmove结果只做一次，见solve_cache.py
+    # target_temp: 目标温度，超过时每个引擎做完一题按占空比休息，见thermal.py
+    # command_timeout: 引擎每条命令的超时秒数，超时认为引擎卡死，重启引擎；standby: 预先启动备用引擎
+    # timing_file: 如 'timing.jsonl'，每个阶段的耗时写一行JSON；结束时总是打印各阶段的耗时统计，见timing.py
+    # batch_size: 每次从数据库读取的题目数，见iter_problems
+    if timing_file is not None:
+        timings.open_jsonl(timing_file)
+    katago_ver, engine_command = katago_engine_setup(weight_name)
+    # 引擎退出、超时时自动重启并重做当前题目，预先启动一个备用引擎
+    pool = EnginePool(engine_command, size=engine_num, timeout=command_timeout, standby=standby)
+    cache = SolveCache(katago_ver) if use_cache else None
 
     # Read problem from MongoDB
     client = MongoClient()
@@ -188,90 +347,158 @@ def do_all_problem():
     q_col = db['q']
     q_do_col = db['q_do']
 
-    batch_size = 10  # 批处理大小
-    publicid_list = []
-    new_values_list = []
-    count = 0
-    batch_count = 0
-
-    # 设置题目范围
-    docs = q_col.find({'status': 2, 'qtype':'死活题', 'level':'8K+', 'size':19}).sort('publicid', 1)
-    #docs = q_col.find({'publicid': {'$in':[3707]}})
-    data_list = [
-            {
-                'publicid': doc.get('publicid'), 
-                'level': doc.get('level'), 
-                'prepos':doc.get('prepos'), 
-                'answers':doc.get('answers'), 
-                'blackfirst':doc.get('blackfirst'),
-                'size':doc.get('size'),
-            } for doc in docs
-        ]
-    for q in data_list:
-        publicid = q.get('publicid')
-        level = q.get('level')
-
-        # 跳过一些题目
-        if already_done(q_do_col, publicid, katago_ver):
-            continue
+    # 上次中断时未写入数据库的结果，先写入q_do
+    journal = ProgressJournal(katago_ver)
+    journal.replay(q_do_col)
+    journal.open()
+
+    # 后台线程读取温度，每做完一题按占空比休息
+    throttle = ThermalThrottle(target=target_temp)
+    # 后台线程合并、批量写数据库，不阻塞做题
+    writer = QDoWriter(q_do_col, katago_ver)
+
+    # 跳过一些题目，题目范围见PROBLEM_CRITERIA
+    done_set = load_done_set(q_do_col, katago_ver)
+    todo_list = iter_problems(q_col, done_set, batch_size=batch_size)
+
+    def solve_one(gtp_engine, q):
+        # 引擎出错时会用新引擎重做，swap_black_white会修改prepos，每次用题目的副本
+        # 多个引擎线程同时做题，做题过程的输出和结果一起返回，在主线程中打印成一行
+        log = []
+        bw, ret, answer = do_one_problem(gtp_engine, copy.deepcopy(q), throttle=throttle, early_stop=early_stop, cache=cache, log=log)
+        return bw, ret, answer, ' '.join(log)
+
+    if race:
+        solved = race_problems(pool, todo_list, early_stop, cache, throttle)
+    else:
+        solved = pool.map_unordered(solve_one, todo_list, skip_errors=True)
+
+    try:
+        for q, (bw, ret, answer, log) in solved:
+            publicid = q.get('publicid')
+            level = q.get('level')
+            print(f"{publicid:>6} {log} {bw_info(bw)} {ret}")
+
+            new_values = {
+                'bw': bw,
+                'ret': ret,
+                'level': level, 
+                'answer': answer
+            }
+            # 先记日志，再交给后台写数据库
+            journal.append(publicid, new_values)
+            writer.put(publicid, new_values)
+    finally:
+        # 停止分发题目，还没开始的取消，之后再关闭引擎
+        solved.close()
+
+        # 写完剩余的记录，Ctrl-C时也执行
+        # 全部写入数据库后清空日志；写入失败时保留，下次启动重放
+        if writer.close():
+            journal.truncate()
+        else:
+            print(f'保留日志 {journal.filename}')
+        journal.close()
+
+        if cache is not None:
+            cache.close()
+            cache.print_stats()
+        throttle.print_stats()
+        timings.print_summary()
+        timings.close()
+
+        # Close GTP engines
+        pool.close()
+
+async def solve_worker_async(engine, todo_queue, done_queue, throttle=None):
+    # 一个引擎一个worker，从todo_queue取题，结果放入done_queue
+    while True:
+        q = await todo_queue.get()
+        if q is None:
+            break
+        start_time = time.time()
+        log = []
+        try:
+            bw, ret, answer = await do_one_problem_async(engine, q, log)
+        except Exception as e:
+            # 和map_unordered(skip_errors=True)相同，出错的题目打印后跳过，不中断其余的题目
+            kind = 'engine error' if isinstance(e, ENGINE_ERRORS) else 'error'
+            print(f"skip {q.get('publicid')} {kind} {e!r}")
+            count('task_failed')
+        else:
+            await done_queue.put((q, bw, ret, answer, ' '.join(log)))
+        if throttle is not None:
+            await asyncio.sleep(throttle.pace_delay(time.time() - start_time))
+
+async def do_all_problem_async(weight_name='b18', engine_num=2, target_temp=60, batch_size=100):
+    # asyncio版本：一个事件循环驱动多个引擎，数据库写入放到线程里，和引擎I/O重叠
+    katago_ver, engine_command = katago_engine_setup(weight_name)
+    engines = await asyncio.gather(*[AsyncGTPEngine(engine_command).start() for i in range(engine_num)])
+
+    client = MongoClient()
+    db = client[db_name]
+    q_col = db['q']
+    q_do_col = db['q_do']
 
-        print(f"{publicid:>6}", end=' ')
-        bw, ret, answer = do_one_problem(gtp_engine1, q, sleep_ratio=0)
-        cooling_gpu()
-        continue
-
-        bw, ret, answer = do_one_problem(gtp_engine, q, sleep_ratio=0)
-
-        new_values = {
-            'bw': bw,
-            'ret': ret,
-            'level': level, 
-            'answer': answer
-        }
-        publicid_list.append(publicid)
-        new_values_list.append(new_values)
-        count += 1
-
-        if count % batch_size == 0:
-            process_batch(q_do_col, publicid_list, new_values_list, katago_ver)
-
-            # 清空批次数据
-            publicid_list = []
-            new_values_list = []
-            count = 0
-            batch_count += 1
-
-            cooling_gpu()
-
-    # 处理剩余不足一个批次的记录
-    if publicid_list:
-        process_batch(q_do_col, publicid_list, new_values_list, katago_ver)
-
-    # Close GTP engine
-    gtp_engine.close()
-    gtp_engine1.close()
-
-def cooling_gpu(temp_threshold=60):
-    s_time = time.time()
-    cpu, gpu, other, cpu_data, gpu_data, other_data = get_temperature()
-    first = 1
-    while cpu>temp_threshold or gpu>temp_threshold or other>temp_threshold:
-        if first:
-            print(f'cooling', end=' ', flush=True)
-            first = 0
-        '''
-        if cpu>temp_threshold and cpu_data:
-            print(cpu_data, end=' ', flush=True)
-        if gpu>temp_threshold and gpu_data:
-            print(gpu_data, end=' ', flush=True)
-        '''
-
-        sleep_time = 5*max(cpu-temp_threshold, gpu-temp_threshold, other-temp_threshold)
-        time.sleep(sleep_time)
-        cpu, gpu, other, cpu_data, gpu_data, other_data = get_temperature()
-    e_time = time.time()
-    duration = e_time - s_time
-    print(f'{duration:>5.2f}s')
+    journal = ProgressJournal(katago_ver)
+    await asyncio.to_thread(journal.replay, q_do_col)
+    journal.open()
+
+    done_set = await asyncio.to_thread(load_done_set, q_do_col, katago_ver)
+    todo_list = iter_problems(q_col, done_set, batch_size=batch_size)
+
+    # 有界队列，题目边读边做
+    todo_queue = asyncio.Queue(maxsize=2 * engine_num)
+    done_queue = asyncio.Queue()
+    throttle = ThermalThrottle(target=target_temp)
+
+    async def feed_problems():
+        try:
+            while True:
+                q = await asyncio.to_thread(next, todo_list, None)
+                if q is None:
+                    break
+                await todo_queue.put(q)
+        except Exception as e:
+            # 读题出错时不再分发，做完已分发的题目后结束
+            print(f'read problems failed {e!r}')
+        for engine in engines:
+            await todo_queue.put(None)
+
+    async def run_workers():
+        try:
+            await asyncio.gather(*[solve_worker_async(engine, todo_queue, done_queue, throttle) for engine in engines])
+        finally:
+            # 总是通知主循环结束，否则主循环一直等待done_queue
+            done_queue.put_nowait(None)
+
+    tasks = [asyncio.create_task(feed_problems()), asyncio.create_task(run_workers())]
+
+    # 数据库写入在后台线程，和引擎I/O重叠
+    writer = QDoWriter(q_do_col, katago_ver)
+    try:
+        while True:
+            item = await done_queue.get()
+            if item is None:
+                break
+            q, bw, ret, answer, log = item
+            publicid = q.get('publicid')
+            print(f"{publicid:>6} {log} {bw_info(bw)} {ret}")
+
+            new_values = {'bw': bw, 'ret': ret, 'level': q.get('level'), 'answer': answer}
+            journal.append(publicid, new_values)
+            writer.put(publicid, new_values)
+    finally:
+        # 出错、Ctrl-C时也写完结果，关闭日志和引擎
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if await asyncio.to_thread(writer.close):
+            journal.truncate()
+        else:
+            print(f'保留日志 {journal.filename}')
+        journal.close()
+        await asyncio.gather(*[engine.close() for engine in engines], return_exceptions=True)
 
 if __name__ == "__main__":
     do_all_problem()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 引擎池：同一组config/model启动N个GTPEngine，并行做题
+# 引擎并行启动，wait_for_ready的等待只付一次；做题时借出空闲引擎，用完归还
+# 每个引擎由EngineSupervisor守护，run()中引擎退出、超时时自动重启并重做，见engine_supervisor.py
+
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+
+from engine_supervisor import EngineSpawner, EngineSupervisor, ENGINE_ERRORS
+from timing import count
+
+class EnginePool:
+    def __init__(self, command, size=1, cwd=None, timeout=None, standby=False, retries=2):
+        # timeout: 每条命令的默认超时，None表示一直等待，这时卡死的引擎无法发现
+        # standby: 预先启动一个备用引擎，引擎重启时直接取用
+        # retries: 引擎出错时，同一个任务最多重做的次数
+        self.command = command
+        self.size = size
+        self.cwd = cwd
+        self.idle = queue.Queue()
+
+        start_time = time.time()
+        self.spawner = EngineSpawner(command, cwd=cwd, timeout=timeout, standby=standby)
+        with ThreadPoolExecutor(max_workers=size) as executor:
+            engines = list(executor.map(lambda i: self.spawner.start_engine(), range(size)))
+        self.supervisors = [EngineSupervisor(self.spawner, engine, retries) for engine in engines]
+        for supervisor in self.supervisors:
+            self.idle.put(supervisor)
+        duration = time.time() - start_time
+        print(f'EnginePool {size} engines ready cost {duration:>5.2f}s')
+
+    @contextmanager
+    def lease_supervisor(self, timeout=None):
+        # 借出一个空闲引擎的守护，with结束后归还
+        try:
+            supervisor = self.idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No idle GTP Engine in pool")
+        try:
+            yield supervisor
+        finally:
+            self.idle.put(supervisor)
+
+    @contextmanager
+    def lease(self, timeout=None):
+        # 借出一个空闲引擎，with结束后归还；已经退出的引擎先重启，with中出错不会重做
+        with self.lease_supervisor(timeout) as supervisor:
+            yield supervisor.healthy_engine()
+
+    def run(self, func, *args, **kwargs):
+        # 用一个空闲引擎执行 func(engine, *args, **kwargs)，引擎出错时换新引擎重做
+        with self.lease_supervisor() as supervisor:
+            return supervisor.run(func, *args, **kwargs)
+
+    def map_unordered(self, func, items, max_pending=None, skip_errors=False):
+        # 把items分发到各个引擎并行执行 func(engine, item)，按完成顺序返回 (item, result)
+        # 同时在途的任务最多max_pending个，items可以是生成器
+        # skip_errors: 重做retries次后引擎仍然出错的item，以及func本身出错的item，打印后跳过，不中断其余的item
+        # 调用方提前结束（生成器close、Ctrl-C）时，取消还没开始的任务，在途的任务在引擎关闭后出错退出
+        if max_pending is None:
+            max_pending = 2 * self.size
+        executor = ThreadPoolExecutor(max_workers=self.size)
+        try:
+            pending = {}
+            items = iter(items)
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < max_pending:
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[executor.submit(self.run, func, item)] = item
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if not skip_errors:
+                            raise
+                        kind = 'engine error' if isinstance(e, ENGINE_ERRORS) else 'error'
+                        print(f'skip {item!r:.60} {kind} {e!r}')
+                        count('task_failed')
+                        continue
+                    yield item, result
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        # 先标记全部守护为关闭，在途任务的引擎出错时不再重启
+        for supervisor in self.supervisors:
+            supervisor.closed = True
+        for supervisor in self.supervisors:
+            supervisor.close()
+        self.spawner.close()
+
+    def restarts(self):
+        return sum(supervisor.restarts for supervisor in self.supervisors)
+
+def square(engine, n):
+    engine.send_command('play B Q16')
+    return n * n
+
+def test():
+    from bench_gtp import fake_engine_command
+    pool = EnginePool(fake_engine_command('-startup', '1'), size=4)
+    for n, result in pool.map_unordered(square, range(10)):
+        print(n, result)
+    pool.close()
+
+if __name__ == "__main__":
+    test()
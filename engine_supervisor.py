@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 引擎守护：KataGo退出、超时不回复、回复格式错误时，重启引擎并重做当前的题目，无人值守时整夜运行不中断
+# EngineSpawner负责启动引擎，standby=True时后台预先启动一个备用引擎，重启时直接取用，省去约120秒的启动等待
+# EngineSupervisor包裹一个引擎，run(func, ...)出错时换新引擎，最多重试retries次
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from gtp_engine import GTPEngine, GTPProtocolError
+from timing import count
+
+# 这些异常说明引擎本身出了问题，需要重启：
+# EOFError 引擎退出，TimeoutError 超时未回复，GTPProtocolError 回复编号不对，BrokenPipeError 向已退出的引擎写命令
+# 其他异常（如题目数据、solver的错误）与引擎无关，不重启也不重做
+ENGINE_ERRORS = (EOFError, TimeoutError, GTPProtocolError, BrokenPipeError)
+
+class EngineSpawner:
+    def __init__(self, command, cwd=None, timeout=None, standby=False):
+        self.command = command
+        self.cwd = cwd
+        self.timeout = timeout # 每条命令的默认超时，见GTPEngine.timeout
+        self.standby = standby
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.closed = False
+        self.standby_future = None
+        if standby:
+            self.standby_future = self.executor.submit(self.start_engine)
+
+    def start_engine(self):
+        engine = GTPEngine(self.command, cwd=self.cwd)
+        engine.timeout = self.timeout
+        return engine
+
+    def spawn(self):
+        # 取用备用引擎（可能还在启动中，等它就绪），再在后台启动下一个备用引擎
+        with self.lock:
+            if self.closed:
+                raise EOFError("EngineSpawner closed")
+            future = self.standby_future
+            if future is not None:
+                self.standby_future = self.executor.submit(self.start_engine)
+        if future is None:
+            return self.start_engine()
+        try:
+            return future.result()
+        except Exception as e:
+            print(f'standby engine failed {e}')
+            return self.start_engine()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            future = self.standby_future
+            self.standby_future = None
+        if future is not None:
+            try:
+                future.result().close()
+            except Exception:
+                pass
+        self.executor.shutdown()
+
+class EngineSupervisor:
+    def __init__(self, spawner, engine=None, retries=2):
+        self.spawner = spawner
+        self.engine = engine if engine is not None else spawner.spawn()
+        self.retries = retries
+        self.restarts = 0
+        self.closed = False # 开始关闭后，引擎出错不再重启，避免关闭后启动的引擎没人关闭
+
+    def alive(self):
+        return self.engine.process.poll() is None
+
+    def restart(self, reason):
+        if self.closed:
+            raise EOFError(f"EngineSupervisor closed: {reason!r}")
+        print(f'restart engine: {reason!r}')
+        count('engine_restart')
+        start_time = time.time()
+        try:
+            self.engine.close()
+        except Exception as e:
+            print(f'close engine failed {e}')
+        self.engine = self.spawner.spawn()
+        self.restarts += 1
+        print(f'engine restarted cost {time.time() - start_time:>5.2f}s')
+
+    def healthy_engine(self):
+        if not self.alive():
+            self.restart(f'exit code {self.engine.process.returncode}')
+        return self.engine
+
+    def run(self, func, *args, **kwargs):
+        # 执行 func(engine, *args, **kwargs)，引擎出错时重启，用新引擎重新执行
+        # func需要能够重复执行，如每次从题目文档重新构造solver
+        for attempt in range(self.retries + 1):
+            engine = self.healthy_engine()
+            try:
+                return func(engine, *args, **kwargs)
+            except ENGINE_ERRORS as e:
+                if attempt == self.retries or self.closed:
+                    raise
+                count('engine_retry')
+                self.restart(e)
+
+    def close(self):
+        self.closed = True
+        self.engine.close()
+
+def genmove(engine):
+    return engine.send_command('genmove b')
+
+def test():
+    from bench_gtp import fake_engine_command
+    spawner = EngineSpawner(fake_engine_command('-crash-after', '3'), timeout=2, standby=True)
+    supervisor = EngineSupervisor(spawner)
+    for i in range(10):
+        print(i, supervisor.run(genmove))
+    supervisor.close()
+    spawner.close()
+
+    spawner = EngineSpawner(fake_engine_command('-hang-after', '2'), timeout=1)
+    supervisor = EngineSupervisor(spawner)
+    for i in range(5):
+        print(i, supervisor.run(genmove))
+    print(f'restarts {supervisor.restarts}')
+    supervisor.close()
+    spawner.close()
+
+if __name__ == "__main__":
+    test()
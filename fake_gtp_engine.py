@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 模拟的GTP引擎：没有KataGo的机器上，用来测量GTPEngine等的吞吐和延迟
+# 用法: python fake_gtp_engine.py [-startup 秒] [-latency 秒] [-no-set-position] [-genmove pass] [-crash-after N] [-hang-after N]
+# -crash-after N: 第N+1次genmove时退出；-hang-after N: 第N+1次genmove起不再回复，用来测试引擎重启
+# genmove的落子是确定的，见choose_move，相同局面总是相同的落子；-genmove pass则总是pass
+
+import sys
+import time
+import queue
+import threading
+
+def reply(text='', ok=True, cmd_id=''):
+    sys.stdout.write(('=' if ok else '?') + cmd_id + ' ' + text + '\n\n')
+    sys.stdout.flush()
+
+def read_stdin(lines):
+    for line in sys.stdin:
+        lines.put(line)
+    lines.put(None)
+
+LETTERS = 'abcdefghjklmnopqrst'
+
+def choose_move(stones, size):
+    # 确定的落子，相同局面总是相同的结果：相邻棋子颜色种类最多、其次相邻棋子最多的空点，空棋盘pass
+    # stones: gtp坐标 -> 颜色，如 {'q16': 'b'}
+    best = None
+    for x in range(size):
+        for y in range(1, size + 1):
+            coord = f'{LETTERS[x]}{y}'
+            if coord in stones:
+                continue
+            neighbors = [(x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)]
+            colors = [stones.get(f'{LETTERS[nx]}{ny}') for nx, ny in neighbors
+                      if 0 <= nx < size and 1 <= ny <= size]
+            colors = [c for c in colors if c]
+            score = (len(set(colors)), len(colors))
+            if colors and (best is None or score > best[0]):
+                best = (score, coord)
+    return best[1].upper() if best else 'pass'
+
+def analyze(lines, interval, move='Q16'):
+    # kata-analyze：每interval输出一行info，直到stdin收到任意输入
+    sys.stdout.write('=\n')
+    sys.stdout.flush()
+    visits = 0
+    while True:
+        try:
+            lines.get(timeout=interval)
+            break
+        except queue.Empty:
+            pass
+        visits += 10
+        sys.stdout.write(f'info move {move} visits {visits} edgeVisits {visits} utility 0.1 winrate 0.6 '
+                         f'scoreMean 1.0 scoreStdev 10.0 scoreLead 1.0 scoreSelfplay 1.0 prior 0.3 lcb 0.55 '
+                         f'utilityLcb 0.05 weight {visits}.0 order 0 pv {move}\n')
+        sys.stdout.flush()
+    sys.stdout.write('\n')
+    sys.stdout.flush()
+
+def main():
+    startup = 0.0
+    latency = 0.0
+    args = sys.argv[1:]
+    if '-startup' in args:
+        startup = float(args[args.index('-startup') + 1])
+    if '-latency' in args:
+        latency = float(args[args.index('-latency') + 1])
+
+    set_position = '-no-set-position' not in args
+    genmove_pass = '-genmove' in args and args[args.index('-genmove') + 1] == 'pass'
+    crash_after = int(args[args.index('-crash-after') + 1]) if '-crash-after' in args else None
+    hang_after = int(args[args.index('-hang-after') + 1]) if '-hang-after' in args else None
+    genmove_count = 0
+
+    time.sleep(startup)
+    sys.stderr.write('GTP ready, beginning main protocol loop\n')
+    sys.stderr.flush()
+
+    lines = queue.Queue()
+    threading.Thread(target=read_stdin, args=(lines,), daemon=True).start()
+    stones = {}
+    size = 19
+    while True:
+        line = lines.get()
+        if line is None:
+            break
+        cmd = line.split()
+        if not cmd:
+            continue
+        # GTP命令编号，回复时原样带回
+        cmd_id = ''
+        if cmd[0].isdigit():
+            cmd_id = cmd.pop(0)
+        if not cmd:
+            continue
+        if cmd[0] == 'quit':
+            reply(cmd_id=cmd_id)
+            break
+        if cmd[0] == 'genmove':
+            if genmove_count == crash_after:
+                sys.exit(1)
+            if genmove_count == hang_after:
+                time.sleep(3600)
+            genmove_count += 1
+            time.sleep(latency)
+            reply('pass' if genmove_pass else choose_move(stones, size), cmd_id=cmd_id)
+        elif cmd[0] == 'kata-analyze':
+            interval = int(cmd[-1]) / 100 if len(cmd) > 1 and cmd[-1].isdigit() else 1.0
+            analyze(lines, interval, choose_move(stones, size))
+        elif cmd[0] == 'known_command':
+            known = cmd[1] != 'set_position' or set_position
+            reply('true' if known else 'false', cmd_id=cmd_id)
+        elif cmd[0] == 'set_position' and set_position:
+            coords = [c.lower() for c in cmd[2::2]]
+            if len(set(coords)) != len(coords):
+                reply('illegal stones', ok=False, cmd_id=cmd_id)
+            else:
+                stones = {c: color.lower() for color, c in zip(cmd[1::2], coords)}
+                reply(cmd_id=cmd_id)
+        elif cmd[0] == 'clear_board' or cmd[0] == 'boardsize':
+            if cmd[0] == 'boardsize':
+                size = int(cmd[1])
+            stones.clear()
+            reply(cmd_id=cmd_id)
+        elif cmd[0] == 'play':
+            if cmd[2].lower() in stones:
+                reply('illegal move', ok=False, cmd_id=cmd_id)
+            else:
+                stones[cmd[2].lower()] = cmd[1].lower()
+                reply(cmd_id=cmd_id)
+        elif cmd[0] == 'set_position':
+            reply('unknown command', ok=False, cmd_id=cmd_id)
+        else:
+            reply(cmd_id=cmd_id)
+
+if __name__ == "__main__":
+    main()
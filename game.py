@@ -7,6 +7,8 @@
 
 import random
 from board import GoProblem, GoBoard
+from position import Position, EMPTY, COLORS
+from answer_tree import AnswerTree
 from pprint import pprint
 from config import full_board_size
 
@@ -22,6 +24,9 @@ class GoGame:
         self.problems = []
         self.current_problem = None
         self.current_problem_index = -1
+        self.position = Position() # 不含绘图的局面，判断提子和合法
+        self.answer_tree = AnswerTree() # 正解的前缀树
+        self.answer_node = self.answer_tree.root # 用户已走的步数在答案树中的节点
 
     def load_problems(self, criteria):
         self.problems = GoProblem.load_problems_from_db(criteria)
@@ -42,21 +47,15 @@ class GoGame:
         # 打印题目关键信息
         print(f'{self.current_problem_index}th {self.current_problem.publicid} {self.current_problem.size}')
 
-        # ty：1正解,2变化,3失败,4淘汰；st：1待审,2审核完成
-        best_answers = [] # 审核完成的正解
-        good_answers = [] # 没审核完成的正解
-        for ans in self.current_problem.answers:
-            if ans['ty'] == 1 and ans['st'] == 2:
-                best_answers.append(ans)
-            if ans['ty'] == 1 and ans['st'] == 1:
-                good_answers.append(ans)
-        if len(best_answers) > 0:
-            self.current_problem.answers = best_answers
-        elif len(good_answers) > 0:
-            self.current_problem.answers = good_answers
+        # 编译成答案树，做题时只看当前节点；有审核完成的正解时只用它们，否则用没审核完成的正解，见select_answers
+        self.answer_tree = AnswerTree.from_answers(self.current_problem.answers)
+        if self.answer_tree.answers:
+            self.current_problem.answers = self.answer_tree.answers
         else:
             p = self.current_problem
             print(f'Warning: No Answer, {p.qtype} {p.level} {len(p.options)}')
+            # 和以前一样，没有正解时按题目的全部答案比对
+            self.answer_tree = AnswerTree(ans['p'] for ans in p.answers)
 
         self.reset_game()
         self.current_color = 'black' if self.current_problem.blackfirst else 'white'
@@ -86,13 +85,11 @@ class GoGame:
 
         # Place preset stones
         self.board.place_preset_stones(self.current_problem.prepos)
+        self.position = Position.from_prepos(self.current_problem.prepos, self.current_problem.size)
 
         # Display hint for the first move
-        first_move = None
-        if self.current_problem.answers:
-            for ans in self.current_problem.answers:
-                first_move = ans['p'][0]
-                self.hint_items.append(self.board.draw_hint(first_move))
+        for first_move in self.answer_tree.first_moves():
+            self.hint_items.append(self.board.draw_hint(first_move))
 
         return {
             'level': self.current_problem.level,
@@ -105,6 +102,7 @@ class GoGame:
         self.board.clear_board()
         self.board.clear_stones()
         self.user_moves = []
+        self.answer_node = self.answer_tree.root
         self.move_number = 1
 
         # Clear previous hints
@@ -115,31 +113,6 @@ class GoGame:
         self.black_captures = 0
         self.white_captures = 0
 
-    def get_group(self, row, col):
-        color = self.board.stones[row][col]['color']
-        group = set()
-        stack = [(row, col)]
-        while stack:
-            r, c = stack.pop()
-            if (r, c) not in group:
-                group.add((r, c))
-                # Check the four neighbors
-                for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-                    nr, nc = r + dr, c + dc
-                    if 0 <= nr < self.board.size and 0 <= nc < self.board.size:
-                        if self.board.stones[nr][nc] is not None and self.board.stones[nr][nc]['color'] == color:
-                            stack.append((nr, nc))
-        return group
-
-    def has_liberties(self, group):
-        for r, c in group:
-            for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-                nr, nc = r + dr, c + dc
-                if 0 <= nr < self.board.size and 0 <= nc < self.board.size:
-                    if self.board.stones[nr][nc] is None:
-                        return True
-        return False
-
     def remove_group(self, group):
         for r, c in group:
             self.board.canvas.delete(self.board.stones[r][c]['stone'])
@@ -148,6 +121,9 @@ class GoGame:
             self.board.stones[r][c] = None
 
     def get_expected_coords(self, move_number):
+        # 当前节点的下一步正解；move_number是已走步数+1
+        if move_number == len(self.user_moves) + 1:
+            return set(self.answer_node.children)
         expected_coords = set()
         for answer in self.current_problem.answers:
             if len(answer['p']) >= move_number:
@@ -155,70 +131,47 @@ class GoGame:
         return expected_coords
 
     def get_expected_next_coords(self, user_moves):
-        expected_coords = set()
-        for answer in self.current_problem.answers:
-            if answer['p'][:len(user_moves)] == user_moves:
-                if len(answer['p']) > len(user_moves):
-                    expected_coords.add(answer['p'][len(user_moves)])
-        return expected_coords
+        if user_moves == self.user_moves:
+            node = self.answer_node
+        else:
+            node = self.answer_tree.find(user_moves)
+        if node is None:
+            return set()
+        return set(node.children)
 
     def make_move(self, row, col):
         # Check if the position is unoccupied
-        if self.board.stones[row][col] is not None:
+        point = self.position.point(row, col)
+        if self.position.color_at(point) != EMPTY:
             return 'invalid_move'
 
-        # Get expected coordinates for the current move number
-        expected_coords = self.get_expected_coords(self.move_number)
-        tolerance = self.board.cell_size / 2  # Allowable distance from the correct point
-        match_found = False
-        coord = None
-
-        for exp_coord in expected_coords:
-            exp_row, exp_col = self.board.coord_to_position(exp_coord)
-            if (exp_row, exp_col) == (row, col):
-                coord = exp_coord
-                match_found = True
-                break
-
-        if not match_found:
+        # 当前节点的子节点就是下一步的全部正解
+        coord = self.board.position_to_coord(row, col)
+        next_node = self.answer_node.children.get(coord)
+        if next_node is None:
             return 'incorrect'  # 返回'错误'状态
 
-        # Place the stone tentatively
+        # Invalid move: self-capture or ko not allowed
+        color = COLORS[self.current_color]
+        if not self.position.is_legal(color, point):
+            return 'invalid_move'
+
+        # Perform captures
+        captured = self.position.play(color, point)
         stone = self.board.draw_stone(row, col, self.current_color)
         label = self.board.draw_stone_number(row, col, self.current_color, self.move_number)
         self.board.stones[row][col] = {'color': self.current_color, 'stone': stone, 'label': label}
-
-        # Perform captures
-        opponent_color = 'white' if self.current_color == 'black' else 'black'
-        captured_stones = 0
-
-        # Check adjacent positions for opponent stones
-        for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-            nr, nc = row + dr, col + dc
-            if 0 <= nr < self.board.size and 0 <= nc < self.board.size:
-                if self.board.stones[nr][nc] is not None and self.board.stones[nr][nc]['color'] == opponent_color:
-                    opponent_group = self.get_group(nr, nc)
-                    if not self.has_liberties(opponent_group):
-                        self.remove_group(opponent_group)
-                        captured_stones += len(opponent_group)
-                        # Record captures
-                        if self.current_color == 'black':
-                            self.black_captures += len(opponent_group)
-                        else:
-                            self.white_captures += len(opponent_group)
-
-        # Now check if own group has liberties
-        own_group = self.get_group(row, col)
-        if not self.has_liberties(own_group):
-            # Invalid move: self-capture not allowed
-            # Remove the placed stone
-            self.board.canvas.delete(self.board.stones[row][col]['stone'])
-            self.board.canvas.delete(self.board.stones[row][col]['label'])
-            self.board.stones[row][col] = None
-            return 'invalid_move'
+        if captured:
+            self.remove_group([self.position.row_col(p) for p in captured])
+            # Record captures
+            if self.current_color == 'black':
+                self.black_captures += len(captured)
+            else:
+                self.white_captures += len(captured)
 
         # The move is valid, proceed
         self.user_moves.append(coord)
+        self.answer_node = next_node
         self.move_number += 1
 
         # Switch color
@@ -229,19 +182,12 @@ class GoGame:
             self.board.canvas.delete(item)
         self.hint_items.clear()
 
-        # Check if the user's sequence matches any of the answers
-        matched_answers = []
-        for answer in self.current_problem.answers:
-            answer_moves = answer['p']
-            if self.user_moves == answer_moves[:len(self.user_moves)]:
-                matched_answers.append(answer)
-                if len(self.user_moves) == len(answer_moves):
-                    return 'correct'
-                break  # Found a matching answer
+        # Check if the user's sequence completes one of the answers
+        if next_node.complete:
+            return 'correct'
 
         # Display hints for the next expected moves
-        next_expected_coords = self.get_expected_next_coords(self.user_moves)
-        for coord in next_expected_coords:
+        for coord in next_node.children:
             self.hint_items.append(self.board.draw_hint(coord))
 
         return 'continue'  # 返回'继续'状态
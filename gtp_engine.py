@@ -3,17 +3,18 @@
 
 import subprocess
 import threading
+import queue
 import time
+from collections import deque
+from contextlib import closing
 from pprint import pprint
-from get_temperature import get_temperature
+from kata_analyze import parse_analyze_line, AnalyzeBudget
+from thermal import get_sampler, ThermalThrottle
+from timing import timings
 
-def cooling_gpu(temp_threshold=60):
-    time.sleep(1)
-    cpu, gpu, other, cpu_data, gpu_data, other_data = get_temperature()
-    while cpu>temp_threshold or gpu>temp_threshold or other>temp_threshold:
-        sleep_time = 5*max(cpu-temp_threshold, gpu-temp_threshold, other-temp_threshold)
-        time.sleep(sleep_time)
-        cpu, gpu, other, cpu_data, gpu_data, other_data = get_temperature()
+class GTPProtocolError(Exception):
+    # 回复的编号和命令不对应，引擎的输出已经错乱，需要重启
+    pass
 
 class GTPEngine:
     def __init__(self, command, cwd=None):
@@ -30,8 +31,13 @@ class GTPEngine:
         )
         self.stdout_thread = threading.Thread(target=self.read_stdout, daemon=True)
         self.stderr_thread = threading.Thread(target=self.read_stderr, daemon=True)
-        self.stdout_lines = []
+        self.stdout_queue = queue.Queue() # stdout行由读线程放入，读取方阻塞等待，无需轮询
         self.stderr_lines = []
+        self.next_id = 0 # 流水线命令的GTP编号
+        self.pending = deque() # 已发送、未读取回复的 (id, command)
+        self.results = {} # 已读取、未取走的回复，id -> result
+        self.known_commands = {} # known_command的查询结果缓存
+        self.timeout = None # 命令的默认超时，调用时没有指定timeout则使用，None表示一直等待
         self.ready = threading.Event()
         self.stdout_thread.start()
         self.stderr_thread.start()
@@ -43,7 +49,9 @@ class GTPEngine:
             #line = line.rstrip('\n') # Only remove the trailing newline
             # Uncomment the next line to see stdout lines
             #print(f"Engine stdout: {line}")
-            self.stdout_lines.append(line)
+            self.stdout_queue.put(line)
+        # 引擎退出，stdout关闭，放入None唤醒等待的读取方
+        self.stdout_queue.put(None)
 
     def read_stderr(self):
         for line in iter(self.process.stderr.readline, ''):
@@ -59,13 +67,105 @@ class GTPEngine:
         else:
             end_time = time.time()
             duration = end_time - self.engine_start_time
+            timings.add('engine_startup', duration)
             print(f'GTP ready cost {duration:>5.2f}s')
 
-    def send_command(self, command, resp_num=1):
-        # Clear any previous stdout_lines
-        if len(self.stdout_lines):
-            print(f'Remain stdout {self.stdout_lines}')
-        self.stdout_lines.clear()
+    def read_line(self, deadline=None):
+        # 阻塞读取一行stdout，deadline为time.time()的绝对时间，None表示一直等待
+        timeout = None
+        if deadline is not None:
+            timeout = max(deadline - time.time(), 0)
+        try:
+            line = self.stdout_queue.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("GTP Engine response timeout")
+        if line is None:
+            self.stdout_queue.put(None) # 保留退出标志，后续读取同样报错
+            raise EOFError("GTP Engine exited")
+        return line
+
+    def clear_stdout(self, tag='Remain'):
+        # 清空上一条命令残留的stdout行
+        remain = []
+        while True:
+            try:
+                line = self.stdout_queue.get_nowait()
+            except queue.Empty:
+                break
+            if line is None:
+                self.stdout_queue.put(None)
+                break
+            remain.append(line)
+        if len(remain):
+            print(f'{tag} stdout {remain}')
+
+    def submit(self, commands):
+        # 流水线提交：给每条命令加上GTP编号一次写入，不等待回复，返回编号列表
+        ids = []
+        lines = ''
+        for command in commands:
+            self.next_id += 1
+            self.pending.append((self.next_id, command))
+            ids.append(self.next_id)
+            lines += f'{self.next_id} {command}\n'
+        self.process.stdin.write(lines)
+        self.process.stdin.flush()
+        return ids
+
+    def read_result(self, deadline=None):
+        # 读取最早一条未回复命令的结果，存入self.results
+        cmd_id, command = self.pending[0]
+        line = self.read_line(deadline)
+        while not (line.startswith('=') or line.startswith('?')):
+            print('line', line)
+            line = self.read_line(deadline)
+        ok = line.startswith('=')
+        resp_id, _, payload = line[1:].rstrip('\n').partition(' ')
+        if resp_id != str(cmd_id):
+            raise GTPProtocolError(f"GTP response id {resp_id} != {cmd_id} '{command}'")
+        # Now read until blank line
+        while True:
+            next_line = self.read_line(deadline)
+            if next_line == '\n':
+                break
+            payload += '\n' + next_line.rstrip('\n')
+        self.pending.popleft()
+        self.results[cmd_id] = {'id': cmd_id, 'command': command, 'ok': ok, 'payload': payload}
+
+    def read_pending(self, deadline=None):
+        # 读完所有流水线命令的回复，避免和后续命令的回复混在一起
+        while self.pending:
+            self.read_result(deadline)
+
+    def wait_results(self, ids, timeout=None):
+        # 按顺序返回ids对应的结果，每个结果: {'id', 'command', 'ok', 'payload'}
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.time() + timeout
+        # 回复按提交顺序返回，读到最后一个编号即全部读到
+        while ids and ids[-1] not in self.results and self.pending:
+            self.read_result(deadline)
+        return [self.results.pop(cmd_id) for cmd_id in ids]
+
+    def send_commands(self, commands, timeout=None):
+        return self.wait_results(self.submit(commands), timeout)
+
+    def known_command(self, name):
+        # 引擎是否支持某个命令，如KataGo扩展的set_position，结果缓存
+        if name not in self.known_commands:
+            result = self.send_commands([f'known_command {name}'])[0]
+            self.known_commands[name] = result['ok'] and result['payload'].strip() == 'true'
+        return self.known_commands[name]
+
+    def send_command(self, command, resp_num=1, timeout=None):
+        # timeout是整个命令（含resp_num个回复）的超时，单位秒
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.time() + timeout
+
+        # Clear any previous stdout lines
+        self.read_pending(deadline)
+        self.clear_stdout()
 
         # Send the command
         self.process.stdin.write(command + '\n')
@@ -75,19 +175,13 @@ class GTPEngine:
         response = ''
         resp_count = 0
         while True:
-            if len(self.stdout_lines) == 0:
-                time.sleep(0.01)
-                continue
-            line = self.stdout_lines.pop(0)
+            line = self.read_line(deadline)
 
             if line.startswith('=') or line.startswith('?'):
                 response += line[1:].rstrip('\n') # Remove the '=' or '?', but keep the rest intact
                 # Now read until blank line
                 while True:
-                    if len(self.stdout_lines) == 0:
-                        time.sleep(0.01)
-                        continue
-                    next_line = self.stdout_lines.pop(0)
+                    next_line = self.read_line(deadline)
                     if next_line == '\n':
                         resp_count += 1
                         if resp_count == resp_num:
@@ -100,74 +194,77 @@ class GTPEngine:
 
     def close(self):
         self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            # 卡死的引擎不响应terminate
+            self.process.kill()
         self.stdout_thread.join()
         self.stderr_thread.join()
 
-    def analyze_command(self, resp_num):
-        interval = 100
+    def analyze(self, color='b', interval=10, budget=None, timeout=None):
+        # kata-analyze流式解析，每个info行yield一次候选手列表（AnalysisMove，按order排序）
+        # budget为AnalyzeBudget，满足停止条件时结束分析
+        # 调用方提前break时，用contextlib.closing包裹，保证停止分析并读完剩余输出
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.time() + timeout
 
-        # Clear any previous stdout_lines
-        if len(self.stdout_lines):
-            print(f'Remain1 stdout {self.stdout_lines}')
-        self.stdout_lines.clear()
+        # Clear any previous stdout lines
+        self.read_pending(deadline)
+        self.clear_stdout('Remain1')
 
         # Send the command
-        self.process.stdin.write(f'kata-analyze b {interval}' + '\n')
+        self.process.stdin.write(f'kata-analyze {color} {interval}' + '\n')
         self.process.stdin.flush()
 
-        # Read the response
+        line = self.read_line(deadline)
+        while not (line.startswith('=') or line.startswith('?')):
+            print('line', line)
+            line = self.read_line(deadline)
+        if line.startswith('?'):
+            self.read_line(deadline) # 错误回复后的空行
+            raise RuntimeError(f"kata-analyze failed: {line[1:].strip()}")
+
+        if budget is not None:
+            budget.start()
+        finished = False
+        try:
+            while True:
+                line = self.read_line(deadline)
+                if line == '\n':
+                    finished = True # 引擎自己结束了分析
+                    return
+                moves = parse_analyze_line(line)
+                if not moves:
+                    continue
+                yield moves
+                if budget is not None and budget.done(moves):
+                    return
+        finally:
+            if not finished and self.process.poll() is None:
+                # 任意输入都会停止分析，读到空行结束
+                self.process.stdin.write('\n')
+                self.process.stdin.flush()
+                stop_deadline = time.time() + 10
+                while self.read_line(stop_deadline) != '\n':
+                    pass
+
+    def analyze_command(self, resp_num, timeout=None):
+        # 分析resp_num行，返回每行的最佳候选手；温度过高时提前停止
+        interval = 100
+        temp_threshold = 75
+        sampler = get_sampler()
         response = []
-        resp_count = 0
-        while True:
-            if len(self.stdout_lines) == 0:
-                time.sleep(0.01)
-                continue
-            line = self.stdout_lines.pop(0)
-
-            if line.startswith('=') or line.startswith('?'):
-                response += line[1:].rstrip('\n') # Remove the '=' or '?', but keep the rest intact
-                # Now read until blank line
-                # info move R16 visits 56 edgeVisits 56
-                # utility -0.292949 winrate 0.36 scoreMean -0.83654 scoreStdev 13.5276 scoreLead -1 scoreSelfplay -1.52978
-                # prior 0.0713674 lcb 0.353621 utilityLcb -0.304088 weight 175.554 order 0 pv R16 D16 D3 Q4 O17 C5 F4 D9 F17
-                while True:
-                    if len(self.stdout_lines) == 0:
-                        time.sleep(interval/1000)
-                        continue
-                    next_line = self.stdout_lines.pop(0)
-
-                    r = next_line.rstrip('\n').split()
-                    m = {
-                        #'move': r[2],
-                        'visits': int(r[4]),
-                        #'winrate': r[10],
-                        #'scoreLead': r[16],
-                        #'pv': r[30:]
-                    }
-                    response.append(m)
-
-                    resp_count += 1
-                    if resp_count == resp_num:
-                        self.process.stdin.write('\n')
-                        self.process.stdin.flush()
-                        break
-
-                    temp_threshold = 75
-                    cpu, gpu, other, cpu_data, gpu_data, other_data = get_temperature()
-                    if cpu>temp_threshold or gpu>temp_threshold or other>temp_threshold:
-                        self.process.stdin.write('\n')
-                        self.process.stdin.flush()
-                        break
-
-                break
-            else:
-                print('line', line)
-
-        # Clear any previous stdout_lines
-        if len(self.stdout_lines):
-            print(f'Remain3 stdout {self.stdout_lines}')
-        self.stdout_lines.clear()
-
+        with closing(self.analyze('b', interval, timeout=timeout)) as infos:
+            for moves in infos:
+                response.append(moves[0])
+                if len(response) == resp_num:
+                    break
+
+                # 读后台线程缓存的温度，不在每行info时调用get_temperature
+                if sampler.read() > temp_threshold:
+                    break
         return response
 
 def send_one_command(gtp_engine):
@@ -221,16 +318,25 @@ def batch_send_command(gtp_engine):
 
 def analyze_command(gtp_engine, max_visits=10):
     start_time = time.time()
+    throttle = ThermalThrottle(target=70)
     visits = 0
     while visits<max_visits:
+        s_time = time.time()
         response = gtp_engine.analyze_command(3)
         print(response)
-        visits = response[-1].get('visits')
-        cooling_gpu(70)
+        visits = response[-1].visits
+        throttle.pace(time.time() - s_time)
     end_time = time.time()
     duration = end_time - start_time
     print(f'cost {duration:>5.2f}s')
 
+def analyze_until_stable(gtp_engine):
+    # 最佳候选手稳定5行，或访问数达到1000，或10秒后停止
+    budget = AnalyzeBudget(max_visits=1000, max_time=10, stable_lines=5, min_visits=50)
+    for moves in gtp_engine.analyze('b', 10, budget):
+        print(' '.join(f'{m.move} {m.visits} {m.winrate:.2f}' for m in moves[:3]))
+    print(budget.reason)
+
 def test():
     # Start GTP engine
     katago_cfg_filename = '/Users/zliu/go/katago/gtp_normal_v500.cfg'
@@ -242,6 +348,7 @@ def test():
     gtp_engine = GTPEngine(engine_command)
 
     analyze_command(gtp_engine, max_visits=1000)
+    #analyze_until_stable(gtp_engine)
     #send_one_command(gtp_engine)
     #batch_send_command(gtp_engine)
 
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# kata-analyze输出解析
+# 一行info包含多个候选手，每个候选手以info开头：
+# info move R16 visits 56 edgeVisits 56 utility -0.292949 winrate 0.36 scoreMean -0.83654 scoreStdev 13.5276 scoreLead -1 scoreSelfplay -1.52978
+#   prior 0.0713674 lcb 0.353621 utilityLcb -0.304088 weight 175.554 order 0 pv R16 D16 D3 Q4 O17 C5 F4 D9 F17 info move D16 ...
+
+import re
+import time
+from collections import namedtuple
+
+# 一个候选手，winrate/scoreLead/lcb都是当前行棋方的视角
+AnalysisMove = namedtuple('AnalysisMove', ['move', 'visits', 'winrate', 'scoreLead', 'lcb', 'prior', 'order', 'pv'])
+
+MOVE_RE = re.compile(r'^([A-HJ-Z][0-9]{1,2}|pass)$', re.IGNORECASE)
+
+def parse_analyze_line(line):
+    # 把一行info解析成候选手列表，按order排序
+    moves = []
+    tokens = line.split()
+    i = 0
+    n = len(tokens)
+    while i < n:
+        if tokens[i] != 'info':
+            i += 1
+            continue
+        fields = {}
+        pv = []
+        i += 1
+        while i < n and tokens[i] != 'info':
+            key = tokens[i]
+            if key == 'pv':
+                i += 1
+                while i < n and MOVE_RE.match(tokens[i]):
+                    pv.append(tokens[i])
+                    i += 1
+                continue
+            if i + 1 < n:
+                fields[key] = tokens[i + 1]
+            i += 2
+        if 'move' not in fields:
+            continue
+        moves.append(AnalysisMove(
+            move=fields['move'],
+            visits=int(fields.get('visits', 0)),
+            winrate=float(fields.get('winrate', 0)),
+            scoreLead=float(fields.get('scoreLead', 0)),
+            lcb=float(fields.get('lcb', 0)),
+            prior=float(fields.get('prior', 0)),
+            order=int(fields.get('order', len(moves))),
+            pv=pv
+        ))
+    moves.sort(key=lambda m: m.order)
+    return moves
+
+class AnalyzeBudget:
+    # 分析的停止条件，任意一个满足即停止
+    # max_visits: 所有候选手的访问数之和达到上限，约等于根节点访问数
+    # max_time: 分析时间达到上限，单位秒
+    # stable_lines: 最佳候选手连续stable_lines行不变，且访问数不少于min_visits
+    def __init__(self, max_visits=None, max_time=None, stable_lines=None, min_visits=0):
+        self.max_visits = max_visits
+        self.max_time = max_time
+        self.stable_lines = stable_lines
+        self.min_visits = min_visits
+        self.start()
+
+    def start(self):
+        self.start_time = time.time()
+        self.best_move = None
+        self.best_count = 0
+        self.reason = None
+
+    def done(self, moves):
+        best = moves[0]
+        if best.move == self.best_move:
+            self.best_count += 1
+        else:
+            self.best_move = best.move
+            self.best_count = 1
+
+        total_visits = sum(m.visits for m in moves)
+        if self.max_visits is not None and total_visits >= self.max_visits:
+            self.reason = 'visits'
+        elif self.max_time is not None and time.time() - self.start_time >= self.max_time:
+            self.reason = 'time'
+        elif (self.stable_lines is not None and self.best_count >= self.stable_lines
+              and best.visits >= self.min_visits):
+            self.reason = 'stable'
+        return self.reason is not None
+
+def test():
+    line = ('info move R16 visits 56 edgeVisits 56 utility -0.292949 winrate 0.36 scoreMean -0.83654 '
+            'scoreStdev 13.5276 scoreLead -1 scoreSelfplay -1.52978 prior 0.0713674 lcb 0.353621 '
+            'utilityLcb -0.304088 weight 175.554 order 0 pv R16 D16 D3 Q4 '
+            'info move D16 visits 20 winrate 0.33 scoreLead -1.5 prior 0.06 lcb 0.3 order 1 pv D16 R16')
+    for m in parse_analyze_line(line):
+        print(m)
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 不依赖Tk的棋盘局面：落子、提子、判断合法，GoGame、solver、matchq都可以使用
+# 棋盘是长度size*size的bytearray，点的编号 point = row * size + col，和GoBoard.stones[row][col]相同
+# 每个点的相邻点预先算好；棋块和气随落子增量更新，不需要每次从头搜索
+# Zobrist哈希随落子、提子增量更新，同时维护8种对称×黑白交换共16个哈希，规范哈希取最小值，用于去重和缓存
+
+import random
+
+EMPTY, BLACK, WHITE = 0, 1, 2
+COLORS = {'b': BLACK, 'w': WHITE, 'black': BLACK, 'white': WHITE}
+
+class IllegalMove(ValueError):
+    pass
+
+def opponent(color):
+    return 3 - color
+
+neighbor_tables = {} # size -> 每个点的相邻点
+
+def neighbor_table(size):
+    if size not in neighbor_tables:
+        table = []
+        for row in range(size):
+            for col in range(size):
+                points = []
+                if row > 0:
+                    points.append((row - 1) * size + col)
+                if row < size - 1:
+                    points.append((row + 1) * size + col)
+                if col > 0:
+                    points.append(row * size + col - 1)
+                if col < size - 1:
+                    points.append(row * size + col + 1)
+                table.append(tuple(points))
+        neighbor_tables[size] = tuple(table)
+    return neighbor_tables[size]
+
+# 8种对称变换，x为列，y为行，n为棋盘路数
+SYMMETRIES = [
+    lambda x, y, n: (x, y),
+    lambda x, y, n: (n - 1 - x, y),
+    lambda x, y, n: (x, n - 1 - y),
+    lambda x, y, n: (n - 1 - x, n - 1 - y),
+    lambda x, y, n: (y, x),
+    lambda x, y, n: (n - 1 - y, x),
+    lambda x, y, n: (y, n - 1 - x),
+    lambda x, y, n: (n - 1 - y, n - 1 - x),
+]
+# 逆变换的下标
+INVERSE = [0, 1, 2, 3, 4, 6, 5, 7]
+
+zobrist_tables = {} # size -> [颜色][点] -> 16个哈希各自要异或的值
+
+def zobrist_table(size):
+    # hashes[k]: k = swap * 8 + t，对称变换t后（swap时黑白交换）的局面的哈希
+    # 固定的随机种子，哈希值在不同进程、不同机器上相同，可以存入数据库
+    if size not in zobrist_tables:
+        rng = random.Random(f'zobrist {size}')
+        keys = [None] + [[rng.getrandbits(64) for point in range(size * size)] for color in (BLACK, WHITE)]
+        sym_points = []
+        for transform in SYMMETRIES:
+            points = []
+            for point in range(size * size):
+                row, col = divmod(point, size)
+                x, y = transform(col, row, size)
+                points.append(y * size + x)
+            sym_points.append(points)
+        table = [None]
+        for color in (BLACK, WHITE):
+            table.append([tuple(keys[color if swap == 0 else opponent(color)][sym_points[t][point]]
+                                for swap in (0, 1) for t in range(8))
+                          for point in range(size * size)])
+        zobrist_tables[size] = table
+    return zobrist_tables[size]
+
+class Group:
+    __slots__ = ('color', 'stones', 'liberties')
+
+    def __init__(self, color, stones, liberties):
+        self.color = color
+        self.stones = stones
+        self.liberties = liberties
+
+class Position:
+    __slots__ = ('size', 'board', 'groups', 'neighbors', 'ko', 'captures', 'zobrist', 'hashes')
+
+    def __init__(self, size=19):
+        self.size = size
+        self.board = bytearray(size * size)
+        self.groups = [None] * (size * size) # 每个点所在的棋块，空点为None
+        self.neighbors = neighbor_table(size)
+        self.ko = None # 劫，不能立即提回的点
+        self.captures = {BLACK: 0, WHITE: 0} # 提子数
+        self.zobrist = zobrist_table(size)
+        self.hashes = [0] * 16
+
+    @classmethod
+    def from_prepos(cls, prepos, size=19):
+        # prepos: {'b': ['aa', ...], 'w': [...]}，sgf坐标，跳过脱先zz、重复和自杀的棋子
+        position = cls(size)
+        for color, coords in prepos.items():
+            if color not in COLORS:
+                continue
+            color = COLORS[color]
+            for coord in coords:
+                point = position.sgf_to_point(coord)
+                if point is None or not position.is_legal(color, point, check_ko=False):
+                    continue
+                position.play(color, point, check_ko=False)
+        position.ko = None
+        return position
+
+    def copy(self):
+        position = Position.__new__(Position)
+        position.size = self.size
+        position.board = bytearray(self.board)
+        position.neighbors = self.neighbors
+        position.ko = self.ko
+        position.captures = dict(self.captures)
+        position.zobrist = self.zobrist
+        position.hashes = list(self.hashes)
+        # 棋块对象不能共用，逐个复制
+        copies = {}
+        position.groups = [None] * len(self.groups)
+        for point, group in enumerate(self.groups):
+            if group is not None:
+                if id(group) not in copies:
+                    copies[id(group)] = Group(group.color, set(group.stones), set(group.liberties))
+                position.groups[point] = copies[id(group)]
+        return position
+
+    def point(self, row, col):
+        return row * self.size + col
+
+    def row_col(self, point):
+        return divmod(point, self.size)
+
+    def sgf_to_point(self, coord):
+        # sgf坐标 'ab' 是第a列第b行，超出棋盘（如zz脱先、tt停一手）返回None
+        col, row = ord(coord[0]) - ord('a'), ord(coord[1]) - ord('a')
+        if 0 <= row < self.size and 0 <= col < self.size:
+            return row * self.size + col
+        return None
+
+    def point_to_sgf(self, point):
+        row, col = divmod(point, self.size)
+        return chr(col + ord('a')) + chr(row + ord('a'))
+
+    def color_at(self, point):
+        return self.board[point]
+
+    def group_at(self, point):
+        return self.groups[point]
+
+    def liberties(self, point):
+        group = self.groups[point]
+        return len(group.liberties) if group is not None else 0
+
+    @property
+    def hash(self):
+        # 局面的64位Zobrist哈希，不含行棋方和劫
+        return self.hashes[0]
+
+    def canonical_hash(self):
+        # 8种对称、黑白交换中最小的哈希，返回 (哈希, 对称下标, 是否黑白交换)
+        h = min(self.hashes)
+        k = self.hashes.index(h)
+        return h, k % 8, k >= 8
+
+    def toggle(self, color, point):
+        keys = self.zobrist[color][point]
+        self.hashes = [h ^ key for h, key in zip(self.hashes, keys)]
+
+    def stones(self, color):
+        return [point for point, c in enumerate(self.board) if c == color]
+
+    def is_legal(self, color, point, check_ko=True):
+        # 空点，不是劫，落子后自己有气（有空的相邻点、相连棋块还有别的气，或者提掉对方的子）
+        if self.board[point] != EMPTY:
+            return False
+        if check_ko and point == self.ko:
+            return False
+        for n in self.neighbors[point]:
+            c = self.board[n]
+            if c == EMPTY:
+                return True
+            liberties = len(self.groups[n].liberties)
+            if c == color and liberties > 1:
+                return True
+            if c != color and liberties == 1:
+                return True
+        return False
+
+    def play(self, color, point, check_ko=True):
+        # 落子，返回提掉的点的列表；不合法时抛出IllegalMove，局面不变
+        if not self.is_legal(color, point, check_ko):
+            raise IllegalMove(f'illegal move {self.point_to_sgf(point)}')
+        board = self.board
+        groups = self.groups
+        board[point] = color
+        self.toggle(color, point)
+        group = Group(color, {point}, set())
+        groups[point] = group
+        captured = []
+        for n in self.neighbors[point]:
+            c = board[n]
+            if c == EMPTY:
+                group.liberties.add(n)
+                continue
+            neighbor_group = groups[n]
+            neighbor_group.liberties.discard(point)
+            if c == color:
+                if neighbor_group is not group:
+                    group = self.merge(group, neighbor_group)
+            elif not neighbor_group.liberties:
+                captured.extend(self.remove(neighbor_group))
+        self.captures[color] += len(captured)
+
+        # 提掉一个子，且新落的子只有一个子一口气，对方不能立即提回
+        self.ko = None
+        if len(captured) == 1 and len(group.stones) == 1 and len(group.liberties) == 1:
+            self.ko = captured[0]
+        return captured
+
+    def merge(self, a, b):
+        # 小的棋块并入大的棋块
+        if len(a.stones) < len(b.stones):
+            a, b = b, a
+        a.stones |= b.stones
+        a.liberties |= b.liberties
+        for p in b.stones:
+            self.groups[p] = a
+        return a
+
+    def remove(self, group):
+        # 提掉一个棋块，提掉的点成为相邻其他棋块的气
+        board = self.board
+        groups = self.groups
+        for p in group.stones:
+            board[p] = EMPTY
+            groups[p] = None
+            self.toggle(group.color, p)
+        for p in group.stones:
+            for n in self.neighbors[p]:
+                neighbor_group = groups[n]
+                if neighbor_group is not None:
+                    neighbor_group.liberties.add(p)
+        return list(group.stones)
+
+    def __str__(self):
+        chars = '.XO'
+        rows = []
+        for row in range(self.size):
+            rows.append(' '.join(chars[c] for c in self.board[row * self.size:(row + 1) * self.size]))
+        return '\n'.join(rows)
+
+def test():
+    # 角上的白子被提，然后打劫
+    position = Position.from_prepos({'b': ['ba', 'ab', 'cb', 'bc'], 'w': ['ca', 'db', 'cc']}, size=9)
+    print(position)
+    print('captured', [position.point_to_sgf(p) for p in position.play(WHITE, position.sgf_to_point('bb'))])
+    print('ko', position.point_to_sgf(position.ko))
+    print(position)
+    print('retake legal', position.is_legal(BLACK, position.sgf_to_point('cb')))
+    print('suicide legal', position.is_legal(WHITE, position.sgf_to_point('aa')))
+
+    # 对称、黑白交换后的局面，规范哈希相同
+    a = Position.from_prepos({'b': ['cc', 'dc'], 'w': ['cd']}, size=19)
+    b = Position.from_prepos({'w': ['qq', 'qp'], 'b': ['pq']}, size=19)
+    print('canonical equal', a.canonical_hash()[0] == b.canonical_hash()[0], a.hash != b.hash)
+
+    import time
+    start_time = time.time()
+    for i in range(100):
+        position = Position(19)
+        color = BLACK
+        for point in range(361):
+            if position.is_legal(color, point):
+                position.play(color, point)
+                color = opponent(color)
+    duration = time.time() - start_time
+    print(f'{1000 * duration / 100:>7.3f}ms/game')
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 做题进度日志：每做完一题立即追加一行到本地文件并落盘，崩溃或Ctrl-C不丢结果
+# 重启时先把日志重放进q_do，再清空日志
+# 每行格式: {"publicid": 477, "ver": "b18-p10", "values": {"bw": 10, "ret": true, ...}}
+
+import json
+import os
+from pymongo import UpdateOne
+
+from timing import span
+
+class ProgressJournal:
+    def __init__(self, katago_ver, filename=None):
+        self.katago_ver = katago_ver
+        if filename is None:
+            filename = f'q_do_{katago_ver}.journal'
+        self.filename = filename
+        self.f = None
+
+    def open(self):
+        self.f = open(self.filename, 'a', encoding='utf-8')
+
+    def append(self, publicid, values):
+        line = json.dumps({'publicid': publicid, 'ver': self.katago_ver, 'values': values}, ensure_ascii=False)
+        with span('journal'):
+            self.f.write(line + '\n')
+            self.f.flush()
+            os.fsync(self.f.fileno())
+
+    def read(self):
+        # 读出日志中的全部记录，最后一行写了一半（崩溃时）则忽略
+        records = []
+        if not os.path.exists(self.filename):
+            return records
+        with open(self.filename, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f'journal skip broken line: {line[:60]}')
+        return records
+
+    def replay(self, q_do_col):
+        # 把上次未写入数据库的结果写入q_do，然后清空日志，upsert可以重复执行
+        records = self.read()
+        if records:
+            bulk_operations = [
+                UpdateOne({'publicid': r['publicid'], 'ver': r['ver']}, {'$set': r['values']}, upsert=True)
+                for r in records
+            ]
+            q_do_col.bulk_write(bulk_operations, ordered=False)
+            print(f'journal replay {len(records)} 条')
+        self.truncate()
+        return len(records)
+
+    def truncate(self):
+        if self.f is not None:
+            self.f.truncate(0)
+        elif os.path.exists(self.filename):
+            open(self.filename, 'w').close()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# q_do的后台批量写入线程：做题线程只把结果放入队列，不等待数据库
+# 同一个publicid的多次更新合并成一个UpdateOne；攒够max_batch条或最早一条等了max_delay秒就写入
+# key_field/name：也用于其他按 {key_field, 'ver'} 更新的表格，如q_cache按key写入
+
+import queue
+import threading
+import time
+from pymongo import UpdateOne
+
+from timing import span, count
+
+class QDoWriter:
+    def __init__(self, q_do_col, katago_ver, max_batch=50, max_delay=2.0, diff=False, key_field='publicid', name='q_do'):
+        self.q_do_col = q_do_col
+        self.katago_ver = katago_ver
+        self.key_field = key_field
+        self.name = name
+        self.stage = 'db' if name == 'q_do' else name # timing中的阶段名，如 db_flush、q_cache_flush
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.diff = diff # 写入前读出已有文档，打印修改内容
+        self.queue = queue.Queue()
+        self.errors = []
+        self.written = 0
+        self.flush_count = 0
+        self.flush_time = 0
+        self.start_time = time.time()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, publicid, values):
+        self.queue.put((publicid, values))
+
+    def run(self):
+        pending = {} # publicid -> 合并后的$set
+        first_time = None
+        while True:
+            timeout = None
+            if pending:
+                timeout = max(first_time + self.max_delay - time.time(), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                # 等待超时，写入已有的
+                self.flush(pending)
+                pending = {}
+                first_time = None
+                continue
+            if item is None:
+                break
+            publicid, values = item
+            pending.setdefault(publicid, {}).update(values)
+            if first_time is None:
+                first_time = time.time()
+            if len(pending) >= self.max_batch:
+                self.flush(pending)
+                pending = {}
+                first_time = None
+        self.flush(pending)
+
+    def flush(self, pending):
+        if not pending:
+            return
+        start_time = time.time()
+        try:
+            if self.diff:
+                existing_docs = self.q_do_col.find({self.key_field: {'$in': list(pending)}, 'ver': self.katago_ver})
+                existing_docs_dict = {doc[self.key_field]: doc for doc in existing_docs}
+                for pid, values in pending.items():
+                    log_diff(pid, existing_docs_dict.get(pid), values)
+            bulk_operations = [
+                UpdateOne({self.key_field: pid, 'ver': self.katago_ver}, {'$set': values}, upsert=True)
+                for pid, values in pending.items()
+            ]
+            with span(f'{self.stage}_flush', size=len(bulk_operations)):
+                self.q_do_col.bulk_write(bulk_operations, ordered=False)
+            self.written += len(bulk_operations)
+            count(f'{self.stage}_written', len(bulk_operations))
+        except Exception as e:
+            print(f'写入{self.name}失败 {e}')
+            self.errors.append(e)
+        self.flush_count += 1
+        self.flush_time += time.time() - start_time
+
+    def close(self):
+        # 写完队列里的全部结果，返回是否全部写入成功
+        self.queue.put(None)
+        self.thread.join()
+        self.print_stats()
+        return not self.errors
+
+    def print_stats(self):
+        duration = time.time() - self.start_time
+        rate = self.written / duration if duration > 0 else 0
+        avg = 1000 * self.flush_time / self.flush_count if self.flush_count else 0
+        print(f'{self.name} 写入 {self.written} 条 {self.flush_count} 批 {rate:.1f}条/s 平均每批 {avg:.1f}ms 失败 {len(self.errors)} 批')
+
+def log_diff(publicid, existing_doc, new_values):
+    if existing_doc is None:
+        print(f"{publicid:>6} 新增")
+    else:
+        for field in new_values:
+            old_value = existing_doc.get(field)
+            new_value = new_values[field]
+            if old_value != new_value:
+                print(f"{publicid:>6} {field:>6} 从 {old_value} 修改为 {new_value}")
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 后台搜索线程：界面线程只提交请求，搜索在线程中进行，Tk主循环不会被数据库查询阻塞
+# 去抖：提交后等待delay秒没有新的请求才开始搜索，快速连续点击只搜索最后一次
+# 取消：每次提交或cancel()都使代号加一，搜索完成时代号已变的结果直接丢弃
+# 结果通过post(result)交给界面线程，如放入queue.Queue，由界面线程用root.after定时取出
+
+import threading
+import time
+
+class SearchWorker:
+    def __init__(self, search, post, delay=0.15):
+        self.search = search # search(request) -> result，在后台线程中执行
+        self.post = post # post(result)，在后台线程中调用，不能直接操作Tk控件
+        self.delay = delay
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.pending = None # (代号, 请求, 提交时间)
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, request):
+        with self.condition:
+            self.generation += 1
+            self.pending = (self.generation, request, time.time())
+            self.condition.notify()
+
+    def cancel(self):
+        with self.condition:
+            self.generation += 1
+            self.pending = None
+
+    def is_current(self, generation):
+        with self.condition:
+            return generation == self.generation
+
+    def next_request(self):
+        # 等待一个请求，并且delay秒内没有更新的请求
+        with self.condition:
+            while not self.closed:
+                if self.pending is None:
+                    self.condition.wait()
+                    continue
+                generation, request, submit_time = self.pending
+                remaining = submit_time + self.delay - time.time()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+                self.pending = None
+                return generation, request
+            return None
+
+    def run(self):
+        while True:
+            item = self.next_request()
+            if item is None:
+                return
+            generation, request = item
+            try:
+                result = self.search(request)
+            except Exception as e:
+                print(f'search failed {e!r}')
+                continue
+            if self.is_current(generation):
+                self.post(result)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+def test():
+    import queue
+    results = queue.Queue()
+
+    def search(request):
+        time.sleep(0.05)
+        return request
+
+    worker = SearchWorker(search, results.put, delay=0.1)
+    # 连续提交只搜索最后一个
+    for i in range(10):
+        worker.submit(i)
+        time.sleep(0.01)
+    time.sleep(0.3)
+    print('debounce', [results.get_nowait() for i in range(results.qsize())])
+
+    # 搜索中提交新请求，旧结果丢弃
+    worker.submit('old')
+    time.sleep(0.12)
+    worker.submit('new')
+    time.sleep(0.3)
+    print('stale', [results.get_nowait() for i in range(results.qsize())])
+
+    worker.submit('cancelled')
+    worker.cancel()
+    time.sleep(0.3)
+    print('cancel', [results.get_nowait() for i in range(results.qsize())])
+    worker.close()
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 相似棋形搜索的内存索引：q_search的每个棋形min_pp是一行，每个"color-x-y"棋子对应一个位图，第i位表示第i行含有这个棋子
+# 一个$all查询是各棋子位图的与，8种对称×黑白交换共16个查询再取或，不需要访问数据库
+# 位图用Python的int，与、或、计数都在C里完成
+# 行按min_pp长度排序，位号越小min_pp越短，最短的前K个就是最低的K个位
+# 启动时从q_search读入一次，保存快照到本地文件；q_search的文档数和最大_id都不变时直接读快照
+# IncrementalSearch：记住最近几次查询每种对称下的棋子和位图，新查询从包含在其中的最大的旧查询开始，只需再与新增的棋子
+#   搜索棋盘上加一个子时只与一个位图；撤掉最后一个子时正好是上一次的查询，不需要计算
+# MongoShapeSearch：不建内存索引时的数据库查询，按预先算好的min_pp长度排序，只取前K个的min_pp，计数由数据库完成，数到上限即停
+# ProblemCache：按min_pp取匹配结果的题目，一次查询取回全部缩略图，最近显示过的题目留在内存中
+
+import os
+import pickle
+import time
+from collections import OrderedDict
+from pymongo import MongoClient
+
+from config import db_name
+
+class ShapeIndex:
+    def __init__(self):
+        self.min_pps = [] # 行号 -> min_pp
+        self.bitmaps = {} # "color-x-y" -> 位图
+        self.fingerprint = None # 建索引时q_search的 (文档数, 最大_id)，判断快照是否过期
+
+    @staticmethod
+    def fingerprint_of(collection):
+        last = collection.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+        return collection.estimated_document_count(), last['_id'] if last else None
+
+    @classmethod
+    def build(cls, collection):
+        # 相同min_pp是同一个棋形，只保留一行
+        start_time = time.time()
+        index = cls()
+        # 先取指纹，读取期间新增的文档下次启动时会重建
+        index.fingerprint = cls.fingerprint_of(collection)
+        shapes = {}
+        for doc in collection.find({}, {'_id': 0, 'min_pp': 1, 'min_pp_list': 1}):
+            min_pp = doc.get('min_pp')
+            if min_pp is not None and min_pp not in shapes:
+                shapes[min_pp] = doc.get('min_pp_list', [])
+        index.min_pps = sorted(shapes, key=len)
+        rows = {}
+        for row, min_pp in enumerate(index.min_pps):
+            for token in shapes[min_pp]:
+                rows.setdefault(token, []).append(row)
+        # 在bytearray中置位，最后一次转成int；直接 bitmap |= 1 << row 每次都复制整个int，是平方复杂度
+        num_bytes = (len(index.min_pps) + 7) // 8
+        for token, token_rows in rows.items():
+            bits = bytearray(num_bytes)
+            for row in token_rows:
+                bits[row >> 3] |= 1 << (row & 7)
+            index.bitmaps[token] = int.from_bytes(bits, 'little')
+        print(f'ShapeIndex build {len(index.min_pps)} shapes {len(index.bitmaps)} tokens cost {time.time() - start_time:>5.2f}s')
+        return index
+
+    @classmethod
+    def load_or_build(cls, collection, filename=None):
+        if filename is None:
+            filename = f'q_search_{db_name}.index'
+        fingerprint = cls.fingerprint_of(collection)
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                index = pickle.load(f)
+            if getattr(index, 'fingerprint', None) == fingerprint:
+                return index
+            print(f"ShapeIndex snapshot {getattr(index, 'fingerprint', None)} != q_search {fingerprint}, rebuild")
+        index = cls.build(collection)
+        index.save(filename)
+        return index
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def match_all(self, tokens, candidates=None):
+        # 同时含有全部tokens的行；candidates是已经匹配了另一部分棋子的位图
+        if not tokens:
+            return 0 if candidates is None else candidates
+        bitmaps = [] if candidates is None else [candidates]
+        for token in tokens:
+            bitmap = self.bitmaps.get(token)
+            if bitmap is None:
+                return 0
+            bitmaps.append(bitmap)
+        bitmaps.sort(key=int.bit_count) # 先与最稀疏的
+        result = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            result &= bitmap
+            if not result:
+                break
+        return result
+
+    def match(self, configurations):
+        # configurations: 每种对称、黑白交换的棋子列表，和$or中的$all相同
+        result = 0
+        for tokens in configurations:
+            result |= self.match_all(tokens)
+        return result
+
+    def count(self, bitmap):
+        return bitmap.bit_count()
+
+    def top(self, bitmap, k=30):
+        # min_pp最短的k个
+        result = []
+        while bitmap and len(result) < k:
+            low = bitmap & -bitmap
+            result.append(self.min_pps[low.bit_length() - 1])
+            bitmap ^= low
+        return result
+
+    def search(self, configurations, k=30):
+        # 返回 (匹配的棋形数, min_pp最短的k个)
+        bitmap = self.match(configurations)
+        return self.count(bitmap), self.top(bitmap, k)
+
+class IncrementalSearch:
+    def __init__(self, index, history=32):
+        self.index = index
+        self.history = history
+        self.states = [] # 最近的查询，每个是 [(frozenset(tokens), 位图), ...]，与configurations一一对应
+
+    def match(self, configurations):
+        state = []
+        result = 0
+        for i, tokens in enumerate(configurations):
+            tokens = frozenset(tokens)
+            bitmap = self.refine(i, tokens)
+            state.append((tokens, bitmap))
+            result |= bitmap
+        self.remember(state)
+        return result
+
+    def refine(self, i, tokens):
+        # 找包含在tokens中的最大的旧查询，再与剩下的棋子
+        if not tokens:
+            return 0
+        base, candidates = frozenset(), None
+        for state in reversed(self.states):
+            if i < len(state):
+                old_tokens, bitmap = state[i]
+                if old_tokens and len(old_tokens) > len(base) and old_tokens <= tokens:
+                    base, candidates = old_tokens, bitmap
+                    if base == tokens:
+                        break
+        return self.index.match_all(tokens - base, candidates)
+
+    def remember(self, state):
+        self.states.append(state)
+        if len(self.states) > self.history:
+            del self.states[0]
+
+    def search(self, configurations, k=30):
+        bitmap = self.match(configurations)
+        return self.index.count(bitmap), self.index.top(bitmap, k)
+
+class MongoShapeSearch:
+    # 棋子少时几乎匹配整个集合，计数数到COUNT_LIMIT即停止，显示为 "10000+"
+    COUNT_LIMIT = 10000
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.prepare()
+
+    def prepare(self):
+        # 补齐min_pp_len（min_pp长度，排序用），在数据库中计算，不传输文档
+        start_time = time.time()
+        result = self.collection.update_many(
+            {'min_pp_len': {'$exists': False}},
+            [{'$set': {'min_pp_len': {'$strLenCP': {'$ifNull': ['$min_pp', '']}}}}])
+        self.collection.create_index('min_pp_len')
+        self.collection.create_index('min_pp_list')
+        if result.modified_count:
+            print(f'MongoShapeSearch prepare {result.modified_count} docs cost {time.time() - start_time:>5.2f}s')
+
+    def search(self, configurations, k=30):
+        # 计数不去重min_pp，相同min_pp的文档很少，作为估计值
+        configurations = [tokens for tokens in configurations if tokens]
+        if not configurations:
+            return 0, []
+        query = {'$or': [{'min_pp_list': {'$all': tokens}} for tokens in configurations]}
+        total = self.collection.count_documents(query, limit=self.COUNT_LIMIT)
+        if total >= self.COUNT_LIMIT:
+            total = f'{self.COUNT_LIMIT}+'
+        # 按min_pp_len排序读取，只取min_pp字段，凑够k个不同的min_pp就停止；相同min_pp的文档很少，最多读4k个
+        cursor = self.collection.find(query, {'_id': 0, 'min_pp': 1}).sort('min_pp_len', 1).limit(4 * k).batch_size(k)
+        top = []
+        for doc in cursor:
+            min_pp = doc.get('min_pp')
+            if min_pp not in top:
+                top.append(min_pp)
+                if len(top) == k:
+                    break
+        cursor.close()
+        return total, top
+
+# 缩略图和点击加载需要的字段，不取选项等大字段
+# answers.p：GoProblem.get_board_extent按棋子和全部答案的落点裁剪缩略图
+THUMBNAIL_FIELDS = ['prepos', 'size', 'blackfirst', 'publicid', 'qtype', 'level', 'status', 'min_pp', 'answers.p']
+
+class ProblemCache:
+    def __init__(self, collection, maxsize=300):
+        self.collection = collection
+        self.maxsize = maxsize
+        self.problems = OrderedDict() # min_pp -> 题目文档，没有入库题目时为None
+
+    def fetch(self, min_pps):
+        # 按min_pps的顺序返回题目，缓存中没有的用一次$in查询取回，每个min_pp取第一道入库的题目
+        found = {min_pp: self.problems[min_pp] for min_pp in min_pps if min_pp in self.problems}
+        missing = [min_pp for min_pp in min_pps if min_pp not in found]
+        if missing:
+            pipeline = [
+                {'$match': {'status': 2, 'min_pp': {'$in': missing}}},
+                {'$project': {field: 1 for field in THUMBNAIL_FIELDS}},
+                {'$group': {'_id': '$min_pp', 'doc': {'$first': '$$ROOT'}}},
+            ]
+            groups = {group['_id']: group['doc'] for group in self.collection.aggregate(pipeline)}
+            for min_pp in missing:
+                found[min_pp] = groups.get(min_pp)
+        for min_pp in min_pps:
+            self.put(min_pp, found[min_pp])
+        return [found[min_pp] for min_pp in min_pps if found[min_pp] is not None]
+
+    def put(self, min_pp, problem):
+        self.problems[min_pp] = problem
+        self.problems.move_to_end(min_pp)
+        while len(self.problems) > self.maxsize:
+            self.problems.popitem(last=False)
+
+def test():
+    client = MongoClient()
+    collection = client[db_name]['q_search']
+    index = ShapeIndex.load_or_build(collection)
+    configurations = [['b-3-3'], ['w-3-3']]
+    for search in (index, IncrementalSearch(index), MongoShapeSearch(collection)):
+        start_time = time.time()
+        total, top_matches = search.search(configurations)
+        print(f'{type(search).__name__} {1000 * (time.time() - start_time):.2f}ms {total}')
+        print(top_matches[:5])
+
+    cache = ProblemCache(client[db_name]['q'])
+    for i in range(2):
+        start_time = time.time()
+        problems = cache.fetch(top_matches)
+        print(f'fetch {1000 * (time.time() - start_time):.2f}ms {len(problems)}')
+
+if __name__ == "__main__":
+    test()
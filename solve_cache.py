@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 做题结果缓存：同一个局面（8种对称、黑白交换）和同一个引擎版本，只让引擎做一次
+# 缓存的是引擎在规范局面下的落子，命中后变换回当前局面，再和本题的正解比对
+# 存放在MongoDB的q_cache表格：{'key', 'ver', 'move'}，key是规范局面的64位Zobrist哈希（16位十六进制）
+# 新的结果由后台线程批量写入，引擎线程不等待数据库，见q_do_writer.py
+
+import random
+import threading
+from pymongo import MongoClient
+
+from q_do_writer import QDoWriter
+from position import SYMMETRIES, INVERSE, BLACK, WHITE, opponent
+from config import db_name
+
+LETTERS = 'ABCDEFGHJKLMNOPQRST'
+
+def sgf_to_xy(coord):
+    return ord(coord[0]) - ord('a'), ord(coord[1]) - ord('a')
+
+def xy_to_sgf(x, y):
+    return chr(x + ord('a')) + chr(y + ord('a'))
+
+side_keys = {} # (行棋方, komi) -> 64位随机数
+
+def side_key(to_move, komi):
+    if (to_move, komi) not in side_keys:
+        side_keys[(to_move, komi)] = random.Random(f'side {to_move} {komi}').getrandbits(64)
+    return side_keys[(to_move, komi)]
+
+def canonical_key(position, to_move, komi):
+    # 局面的16个Zobrist哈希各自加上行棋方和komi，取最小值，返回 (key, 对称下标)
+    # 黑白交换时行棋方交换，komi取反
+    best = None
+    for k, h in enumerate(position.hashes):
+        swap = k >= 8
+        if swap:
+            h ^= side_key(opponent(to_move), -komi)
+        else:
+            h ^= side_key(to_move, komi)
+        if best is None or h < best[0]:
+            best = (h, k % 8)
+    return f'{best[0]:016x}', best[1]
+
+class SolveCache:
+    def __init__(self, katago_ver, collection=None):
+        if collection is None:
+            client = MongoClient()
+            collection = client[db_name]['q_cache']
+        self.collection = collection
+        self.katago_ver = katago_ver
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # 启动时一次读入本版本的全部缓存
+        self.moves = {}
+        for doc in collection.find({'ver': katago_ver}, {'_id': 0, 'key': 1, 'move': 1}):
+            self.moves[doc['key']] = doc['move']
+        self.writer = QDoWriter(collection, katago_ver, key_field='key', name='q_cache')
+
+    def position_key(self, solver):
+        to_move = BLACK if solver.blackfirst else WHITE
+        return canonical_key(solver.position(), to_move, solver.komi)
+
+    def lookup(self, solver):
+        # 命中返回当前局面的gtp坐标落子，否则返回None
+        key, t = self.position_key(solver)
+        with self.lock:
+            move = self.moves.get(key)
+            if move is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        if move in ('pass', 'resign'):
+            return move
+        x, y = sgf_to_xy(move)
+        x, y = SYMMETRIES[INVERSE[t]](x, y, solver.board_size)
+        return f"{LETTERS[x]}{solver.board_size - y}"
+
+    def store(self, solver, move):
+        # move是引擎返回的gtp坐标，变换到规范局面后保存
+        move = move.strip()
+        if not solver.is_valid_move(move):
+            return
+        key, t = self.position_key(solver)
+        if move.lower() in ('pass', 'resign'):
+            canonical_move = move.lower()
+        else:
+            x = LETTERS.index(move[0].upper())
+            y = solver.board_size - int(move[1:])
+            canonical_move = xy_to_sgf(*SYMMETRIES[t](x, y, solver.board_size))
+        with self.lock:
+            self.moves[key] = canonical_move
+        self.writer.put(key, {'move': canonical_move})
+
+    def close(self):
+        # 写完队列里的缓存，返回是否全部写入成功
+        return self.writer.close()
+
+    def print_stats(self):
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0
+        print(f'cache hit {self.hits} miss {self.misses} 命中率 {ratio:.2%}')
@@ -2,11 +2,32 @@
 # -*- coding: utf-8 -*-
 
 import time
+from contextlib import closing
 from pymongo import MongoClient, UpdateOne
 
 from gtp_engine import GTPEngine
+from kata_analyze import AnalyzeBudget
+from position import Position, BLACK, WHITE
+from answer_tree import AnswerTree
+from timing import span, count
 from config import db_name
 
+# 提前结束做题的默认参数：kata-analyze流式分析，最佳候选手足够领先时立即判定
+# min_visits: 最佳候选手至少的访问数
+# lead_ratio: 最佳候选手访问数是对比候选手的倍数
+# winrate_lead: 或者胜率领先对比候选手
+# reject_visits: 判定做错前，总访问数至少达到
+# max_visits, max_time: 分析的上限，到达后按最佳候选手判定
+EARLY_STOP = {
+    'min_visits': 50,
+    'lead_ratio': 3.0,
+    'winrate_lead': 0.2,
+    'reject_visits': 200,
+    'max_visits': 1000,
+    'max_time': 30,
+    'interval': 10,
+}
+
 def sgf_coord_to_xy(coord):
     col_letter = coord[0]
     row_letter = coord[1]
@@ -58,6 +79,11 @@ class GoProblemSolver:
             self.transform_coordinates()
         self.bw_flag = False #交换黑白，默认不交换
         self.ko_symmetry = False #对于劫活，制造对称死活，相当于劫财，默认不需要劫财
+        self.bulk_setup = True #引擎支持时，用set_position一次摆好全部棋子
+        self.early_stop = None #提前结束做题的参数，如EARLY_STOP，None表示genmove做完
+        self.cancel = None #threading.Event，置位后流式分析停止，用于多个变体竞速
+        self.cache = None #SolveCache，genmove做题前先查缓存
+        self.log = [] #做题过程的输出，多个引擎线程同时做题，由调用方合成一行打印，不和其他题目的输出混在一起
 
     def compute_minimal_board(self):
         # Collect all coordinates
@@ -175,17 +201,10 @@ class GoProblemSolver:
             sgf += f"AW{stones}\n"
 
         if with_answer:
-            # Now add the variations
-            for answer in self.transformed_answers:
-                moves = answer.get('p', [])
-                if not moves:
-                    continue
-                variation = ''
-                current_color = 'B' if self.blackfirst else 'W'
-                for move in moves:
-                    variation += f";{current_color}[{move}]"
-                    current_color = 'W' if current_color == 'B' else 'B'
-                sgf += f"({variation})\n"
+            # Now add the variations，全部正解合并成一棵变化树
+            tree = AnswerTree(answer['p'] for answer in self.transformed_answers if answer.get('p'))
+            if tree.count:
+                sgf += tree.to_sgf('B' if self.blackfirst else 'W') + "\n"
 
         sgf += ")\n"
         return sgf
@@ -221,59 +240,97 @@ class GoProblemSolver:
             return False
         return True
 
-    def solve_problem(self, gtp_engine):
-        size = self.board_size
-
-        start_time = time.time()
-        cmd_str = ''
-        resp_num = 0
-
-        cmd_str += f"boardsize {size}\n"
-        resp_num += 1
-        #response = gtp_engine.send_command(f"boardsize {size}")
-        cmd_str += f"clear_board\n"
-        resp_num += 1
-        #response = gtp_engine.send_command("clear_board")
+    def position(self):
+        # 摆题后的局面，和逐个play相同：重复的棋子只保留第一个，没有气的棋子被提掉
+        prepos = {color: self.transformed_prepos.get(color, []) for color in ['b', 'w']}
+        return Position.from_prepos(prepos, self.board_size)
 
-        cmd_str += f"komi {self.komi}\n"
-        resp_num += 1
+    def setup_commands(self, bulk=False):
+        # 摆放题目的GTP命令列表
+        # bulk: 用KataGo的set_position一条命令摆好全部棋子，不用每个棋子一个play
+        size = self.board_size
+        if bulk:
+            # 棋子取自position()，没有重复和无气的棋子，set_position不会因此失败
+            position = self.position()
+            stones = []
+            for color, name in [(BLACK, 'B'), (WHITE, 'W')]:
+                for point in position.stones(color):
+                    y, x = position.row_col(point)
+                    stones.append(f'{name} {xy_to_gtp_coord(x, y, size)}')
+            return [f"boardsize {size}", f"komi {self.komi}", 'set_position ' + ' '.join(stones)]
+
+        cmd_list = [f"boardsize {size}", "clear_board", f"komi {self.komi}"]
 
         # Place the initial stones
         for coord in self.transformed_prepos.get('b', []):
             x, y = sgf_coord_to_xy(coord)
             gtp_coord = xy_to_gtp_coord(x, y, size)
-            cmd_str += f'play B {gtp_coord}\n'
-            resp_num += 1
-            #response = gtp_engine.send_command(f"play B {gtp_coord}")
+            cmd_list.append(f'play B {gtp_coord}')
         for coord in self.transformed_prepos.get('w', []):
             x, y = sgf_coord_to_xy(coord)
             gtp_coord = xy_to_gtp_coord(x, y, size)
-            cmd_str += f'play W {gtp_coord}\n'
-            resp_num += 1
-            #response = gtp_engine.send_command(f"play W {gtp_coord}")
-        response = gtp_engine.send_command(cmd_str, resp_num)
-
-        end_time = time.time()
-        duration = end_time - start_time
-        print(f'{duration:>5.2f}s', end=' ')
+            cmd_list.append(f'play W {gtp_coord}')
+        return cmd_list
+
+    def setup_command(self, bulk=False):
+        # 摆放题目的GTP命令串和回复数量
+        cmd_list = self.setup_commands(bulk)
+        return '\n'.join(cmd_list) + '\n', len(cmd_list)
+
+    def use_bulk_setup(self, gtp_engine):
+        return self.bulk_setup and gtp_engine.known_command('set_position')
+
+    def print_setup_failed(self, results):
+        for r in results:
+            if not r['ok']:
+                self.log.append(f"Setup failed '{r['command'][:40]}' {r['payload']}")
+
+    def setup_board(self, gtp_engine, bulk=None):
+        # 摆题，优先set_position，失败（如棋子重复）时退回逐个play
+        if bulk is None:
+            bulk = self.use_bulk_setup(gtp_engine)
+        with span('setup', publicid=self.publicid):
+            results = gtp_engine.send_commands(self.setup_commands(bulk))
+            if bulk and not all(r['ok'] for r in results):
+                self.log.append('set_position failed, fallback to play')
+                count('setup_fallback')
+                results = gtp_engine.send_commands(self.setup_commands())
+        self.print_setup_failed(results)
+        return results
+
+    def genmove_command(self):
+        color = 'b' if self.blackfirst else 'w'
+        return f"genmove {color.upper()}"
 
-        #response = gtp_engine.send_command('showboard')
-        #print(response)
+    def is_answer_move(self, move):
+        # 引擎的gtp坐标是否是正解第一步，劫财对称时对称点也算
+        if not self.is_valid_move(move) or move.lower() in ('pass', 'resign'):
+            return False
+        x, y = gtp_coord_to_xy(move, self.board_size)
+        engine_moves = {xy_to_sgf_coord(x, y)}
+        if self.ko_symmetry:
+            engine_moves.add(xy_to_sgf_coord(18 - x, 18 - y))
+        for answer in self.transformed_answers:
+            answer_moves = answer.get('p', [])
+            if answer_moves and answer_moves[0] in engine_moves:
+                return True
+        return False
 
-        # Now generate move
+    def check_move(self, response):
+        # 把genmove的回复和正解的第一步比对
+        size = self.board_size
         color = 'b' if self.blackfirst else 'w'
-        response = gtp_engine.send_command(f"genmove {color.upper()}")
         move = response.strip()
         # Convert move to x,y
         if not self.is_valid_move(move):
-            print(f"Invalid move '{move}' response '{response}' ")
+            self.log.append(f"Invalid move '{move}' response '{response}'")
             return False, {'color':color, 'move': move}
         engine_move_sym = '--'
         if move.lower() == 'resign' or move.lower() == 'pass':
-            print(f"{color} {move:>6}", end=' ')
+            self.log.append(f"{color} {move:>6}")
             engine_move = move.lower()
         else:
-            print(f"{color} {move:>6}", end=' ')
+            self.log.append(f"{color} {move:>6}")
             x, y = gtp_coord_to_xy(move, size)
 
             sgf_move = xy_to_sgf_coord(x, y)
@@ -286,7 +343,7 @@ class GoProblemSolver:
 
                 engine_move_sym = coord_reflected
                 move_sym = xy_to_gtp_coord(x_reflected, y_reflected, self.board_size)
-                print(f"{move_sym:>6}", end=' ')
+                self.log.append(f"{move_sym:>6}")
 
         # Now compare engine_move to answers
         matching = False
@@ -294,13 +351,111 @@ class GoProblemSolver:
             answer_moves = answer.get('p', [])
             if answer_moves and (answer_moves[0] == engine_move or answer_moves[0] == engine_move_sym):
                 matching = True
-                print("OK ", end=' ')
+                self.log.append("OK")
                 return True, {'color':color, 'move': move}
         if not matching:
-            print("ERR", end=' ')
+            self.log.append("ERR")
             return False, {'color':color, 'move': move}
         # Optionally, continue playing out the sequence
 
+    def submit_problem(self, gtp_engine):
+        # 摆题和genmove一起流水线提交，不等待回复，返回命令编号，再用collect_result读取本题结果
+        # 做题时一个引擎一次只做一题，不跨题流水线：做错时要在同一个引擎上重摆变体再做，提前提交的下一题会被清掉
+        bulk = self.use_bulk_setup(gtp_engine)
+        return gtp_engine.submit(self.setup_commands(bulk) + [self.genmove_command()])
+
+    def collect_result(self, gtp_engine, ids, timeout=None):
+        with span('genmove', publicid=self.publicid):
+            results = gtp_engine.wait_results(ids, timeout)
+        setup_results = results[:-1]
+        if any(r['command'].startswith('set_position') and not r['ok'] for r in setup_results):
+            # set_position失败，genmove是在空棋盘上做的，逐个play重新摆题再做
+            self.log.append('set_position failed, fallback to play')
+            count('setup_fallback')
+            self.setup_board(gtp_engine, bulk=False)
+            with span('genmove', publicid=self.publicid):
+                results = gtp_engine.send_commands([self.genmove_command()], timeout)
+        else:
+            self.print_setup_failed(setup_results)
+        with span('compare'):
+            return self.check_move(results[-1]['payload'])
+
+    def solve_problem(self, gtp_engine):
+        if self.early_stop is not None:
+            return self.solve_problem_early_stop(gtp_engine)
+
+        if self.cache is not None:
+            with span('cache_lookup'):
+                move = self.cache.lookup(self)
+            if move is not None:
+                self.log.append('cache')
+                return self.check_move(move)
+
+        # 摆题和genmove一起流水线提交，只等待一次回复；set_position失败时collect_result退回逐个play再做
+        # 摆题的耗时包含在genmove阶段中
+        ret, ans = self.collect_result(gtp_engine, self.submit_problem(gtp_engine))
+        if self.cache is not None:
+            self.cache.store(self, ans['move'])
+        return ret, ans
+
+    def solve_problem_early_stop(self, gtp_engine):
+        # 流式分析，最佳候选手是正解且足够领先时立即判定做对；
+        # 最佳候选手不是正解且领先所有正解候选手时判定做错；否则到上限后按最佳候选手判定
+        p = {**EARLY_STOP, **self.early_stop}
+        start_time = time.time()
+        self.setup_board(gtp_engine)
+        end_time = time.time()
+        self.log.append(f'{end_time - start_time:>5.2f}s')
+
+        color = 'b' if self.blackfirst else 'w'
+        budget = AnalyzeBudget(max_visits=p['max_visits'], max_time=p['max_time'])
+        moves = []
+        ret = None
+        with span('analyze', publicid=self.publicid), closing(gtp_engine.analyze(color, p['interval'], budget)) as infos:
+            for moves in infos:
+                if self.cancel is not None and self.cancel.is_set():
+                    self.log.append("cancelled")
+                    return False, {'color': color, 'move': '', 'cancelled': True}
+                best = moves[0]
+                if best.visits < p['min_visits']:
+                    continue
+                best_is_answer = self.is_answer_move(best.move)
+                # 对比候选手：做对时是第二名，做错时是访问数最多的正解候选手
+                if best_is_answer:
+                    rivals = moves[1:2]
+                else:
+                    rivals = [m for m in moves if self.is_answer_move(m.move)][:1]
+                    if sum(m.visits for m in moves) < p['reject_visits']:
+                        continue
+                rival = rivals[0] if rivals else None
+                if (rival is None or best.visits >= p['lead_ratio'] * rival.visits
+                        or best.winrate - rival.winrate >= p['winrate_lead']):
+                    ret = best_is_answer
+                    break
+
+        if not moves:
+            self.log.append("Invalid analyze")
+            return False, {'color': color, 'move': ''}
+        best = moves[0]
+        visits = sum(m.visits for m in moves)
+        if ret is None:
+            ret = self.is_answer_move(best.move) # 到达上限
+        self.log.append(f"{color} {best.move:>6} {visits:>5}v")
+        self.log.append("OK" if ret else "ERR")
+        return ret, {'color': color, 'move': best.move, 'visits': visits}
+
+    async def solve_problem_async(self, engine):
+        # 和solve_problem相同，engine是AsyncGTPEngine
+        with span('setup', publicid=self.publicid) as s:
+            cmd_str, resp_num = self.setup_command()
+            response = await engine.command(cmd_str, resp_num)
+        self.log.append(f'{s.duration:>5.2f}s')
+
+        with span('genmove', publicid=self.publicid):
+            response = await engine.command(self.genmove_command())
+        with span('compare'):
+            return self.check_move(response)
+
     def swap_black_white_with_transform(self):
         # Swap the preposition stones
         self.prepos['b'], self.prepos['w'] = self.prepos.get('w', []), self.prepos.get('b', [])
@@ -588,7 +743,7 @@ def test():
 
     end_time = time.time()
     duration = end_time-start_time
-    print(f'{duration:>5.2f}s')
+    print(' '.join(solver.log), f'{duration:>5.2f}s')
 
     # Close GTP engine
     gtp_engine.close()
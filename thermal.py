@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 温度控制：后台线程定时读取温度并缓存，按占空比平滑降低做题速度，代替停停走走的cooling_gpu
+# 每做完一题，按占空比休息：duty=1不休息，duty=0.5做多久休息多久
+# 温度高于目标时占空比逐渐下降，低于目标时逐渐回升
+
+import threading
+import time
+from get_temperature import get_temperature
+
+class TemperatureSampler:
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self.temp = 0
+        self.sample_time = 0
+        self.lock = threading.Lock()
+        self.sample()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        cpu, gpu, other, cpu_data, gpu_data, other_data = get_temperature()
+        with self.lock:
+            self.temp = max(cpu, gpu, other)
+            self.sample_time = time.time()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception as e:
+                print(f'get_temperature failed {e}')
+
+    def read(self):
+        # 最近一次的最高温度，不阻塞
+        with self.lock:
+            return self.temp
+
+shared_sampler = None
+
+def get_sampler():
+    # 进程内共用一个采样线程
+    global shared_sampler
+    if shared_sampler is None:
+        shared_sampler = TemperatureSampler()
+    return shared_sampler
+
+class ThermalThrottle:
+    def __init__(self, target=60, gain=0.01, min_duty=0.1, sampler=None):
+        self.target = target # 目标温度
+        self.gain = gain # 每超过1度、每秒，占空比的变化量
+        self.min_duty = min_duty
+        self.sampler = sampler or get_sampler()
+        self.duty = 1.0
+        self.update_time = time.time()
+        self.lock = threading.Lock()
+
+    def update(self):
+        with self.lock:
+            now = time.time()
+            dt = now - self.update_time
+            self.update_time = now
+            error = self.sampler.read() - self.target
+            self.duty = min(1.0, max(self.min_duty, self.duty - self.gain * error * dt))
+            return self.duty
+
+    def pace_delay(self, work_time):
+        # 做了work_time秒后需要休息的时间
+        duty = self.update()
+        return work_time * (1 - duty) / duty
+
+    def pace(self, work_time):
+        delay = self.pace_delay(work_time)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def print_stats(self):
+        print(f'温度 {self.sampler.read()} 目标 {self.target} 占空比 {self.duty:.2f}')
+
+def test():
+    throttle = ThermalThrottle()
+    for i in range(5):
+        start_time = time.time()
+        time.sleep(1) # 模拟做一题
+        delay = throttle.pace(time.time() - start_time)
+        print(f'休息 {delay:.2f}s', end=' ')
+        throttle.print_stats()
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 做题流水线的计时：with span('genmove'): ... 记录每个阶段的耗时，count('cache_hit') 计数
+# 全进程共用一个timings，多个引擎线程可以同时记录
+# 结束时print_summary()打印每个阶段的次数、总耗时、p50/p99；open_jsonl()后每个span写一行JSON，便于事后分析
+# 每行格式: {"name": "genmove", "start": 1718000000.123, "duration": 0.52, "publicid": 477}
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+class Span:
+    def __init__(self, name):
+        self.name = name
+        self.duration = 0
+
+class Timings:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = {} # name -> [秒]
+        self.counters = {}
+        self.f = None
+        self.start_time = time.time()
+
+    @contextmanager
+    def span(self, name, **fields):
+        s = Span(name)
+        start = time.perf_counter()
+        try:
+            yield s
+        finally:
+            s.duration = time.perf_counter() - start
+            self.add(name, s.duration, **fields)
+
+    def add(self, name, duration, **fields):
+        # 记录一个已经结束的阶段，用于开始时间不在with里的，如引擎启动
+        with self.lock:
+            self.durations.setdefault(name, []).append(duration)
+            if self.f is not None:
+                line = {'name': name, 'start': round(time.time() - duration, 3), 'duration': round(duration, 6), **fields}
+                self.f.write(json.dumps(line, ensure_ascii=False) + '\n')
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def open_jsonl(self, filename):
+        self.f = open(filename, 'a', encoding='utf-8')
+
+    def close(self):
+        with self.lock:
+            if self.f is not None:
+                self.f.close()
+                self.f = None
+
+    def reset(self):
+        with self.lock:
+            self.durations = {}
+            self.counters = {}
+            self.start_time = time.time()
+
+    def print_summary(self):
+        # share是总耗时占墙钟时间的比例，多个引擎并行时可以超过100%
+        with self.lock:
+            durations = {name: sorted(values) for name, values in self.durations.items()}
+            counters = dict(self.counters)
+        wall = time.time() - self.start_time
+        print(f"{'stage':<16} {'count':>8} {'total':>9} {'share':>6} {'avg':>9} {'p50':>9} {'p99':>9} {'max':>9}")
+        for name, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+            total = sum(values)
+            n = len(values)
+            p50 = values[n // 2]
+            p99 = values[min(n - 1, int(0.99 * n))]
+            share = total / wall if wall > 0 else 0
+            print(f'{name:<16} {n:>8} {total:>8.2f}s {share:>6.1%} {1000 * total / n:>7.1f}ms '
+                  f'{1000 * p50:>7.1f}ms {1000 * p99:>7.1f}ms {1000 * values[-1]:>7.1f}ms')
+        for name, value in sorted(counters.items()):
+            print(f'{name:<16} {value:>8}')
+        print(f'wall {wall:.2f}s')
+
+timings = Timings()
+span = timings.span
+count = timings.count
+
+def test():
+    for i in range(20):
+        with span('genmove', publicid=i):
+            time.sleep(0.01)
+        with span('setup'):
+            time.sleep(0.001)
+        count('problem')
+    with span('cache_lookup') as s:
+        pass
+    print(f'{s.duration:.6f}s')
+    timings.print_summary()
+
+if __name__ == "__main__":
+    test()